@@ -1,12 +1,22 @@
 import sys
 import os
+import multiprocessing
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 from etif import *
 
 
+# Largest size of the manual tab cover preview
+PREVIEW_SIZE = (640, 400)
+
+
 class combo(QComboBox):
+    # Emitted with the list of files dropped onto the combobox
+    filesAdded = pyqtSignal(list)
+    # Emitted with the list of files about to be removed from the combobox
+    filesRemoved = pyqtSignal(list)
+
     def __init__(self, title, parent):
         super(combo, self).__init__(parent)
         self.setAcceptDrops(True)
@@ -21,6 +31,15 @@ class combo(QComboBox):
         items = e.mimeData().text().replace("file:///", "").split("\n")
         for item in items:
             self.addItem(item)
+        self.filesAdded.emit([item for item in items if item])
+
+    def removeItem(self, index):
+        self.filesRemoved.emit([self.itemText(index)])
+        super(combo, self).removeItem(index)
+
+    def clear(self):
+        self.filesRemoved.emit([self.itemText(i) for i in range(self.count())])
+        super(combo, self).clear()
 
 
 class WorkerSignals(QObject):
@@ -68,10 +87,27 @@ class Worker(QRunnable):
         self.fn = fn
         self.args = args
         self.kwargs = kwargs
+        self.cancel_token = None
 
     def getProgressSignal(self):
         return self.signals.progress
 
+    # Token checked by the running job, see MetadataGenerator.exec
+    def setCancellationToken(self, cancel_token):
+        self.cancel_token = cancel_token
+
+    def cancel(self):
+        if self.cancel_token is not None:
+            self.cancel_token.cancel()
+
+    def pause(self):
+        if self.cancel_token is not None:
+            self.cancel_token.pause()
+
+    def resume(self):
+        if self.cancel_token is not None:
+            self.cancel_token.resume()
+
     @pyqtSlot()
     def run(self):
         """
@@ -85,6 +121,58 @@ class Worker(QRunnable):
             self.signals.finished.emit()  # Done
 
 
+class PrefetchTask(QRunnable):
+    '''
+    Low priority background preparation of files added to the combobox.
+    Metadata of all files is read in one batch, then each file is prepared
+    by MetadataGenerator.prefetchFile unless it was cancelled in the meantime.
+    '''
+
+    def __init__(self, generator, files, combine_original_images, decode_quality, preview_side):
+        super(PrefetchTask, self).__init__()
+        self.generator = generator
+        self.files = files
+        self.combine_original_images = combine_original_images
+        self.decode_quality = decode_quality
+        self.preview_side = preview_side
+        self.cancelled_files = set()
+        self.cancelled_all = False
+
+    def cancel(self, files=None):
+        if files is None:
+            self.cancelled_all = True
+        else:
+            self.cancelled_files.update(files)
+
+    def isCancelled(self, file):
+        return self.cancelled_all or file in self.cancelled_files
+
+    @pyqtSlot()
+    def run(self):
+        # Pool threads are reused by generation jobs, so the priority they had is put back afterwards
+        priority = QThread.currentThread().priority()
+        QThread.currentThread().setPriority(QThread.LowestPriority)
+        try:
+            files = [file for file in self.files if not self.isCancelled(file)]
+            if files:
+                self.generator.readRawMetadata(files)
+            for file in files:
+                if self.isCancelled(file):
+                    continue
+                self.generator.prefetchFile(
+                    file,
+                    self.combine_original_images,
+                    self.decode_quality,
+                    self.preview_side,
+                    lambda: self.isCancelled(file),
+                )
+        except Exception as e:
+            debug("ERROR", PrefetchTask.run.__name__, e)
+        finally:
+            # Qt ignores InheritPriority when setting the priority of a running thread
+            QThread.currentThread().setPriority(priority if priority != QThread.InheritPriority else QThread.NormalPriority)
+
+
 class MainApp(QMainWindow):
     def __init__(self):
         super(MainApp, self).__init__()
@@ -97,10 +185,29 @@ class MainApp(QMainWindow):
             self.settings.getSettings().get("settings").get("Brand_Logo_Path")
         )
         self.generator = MetadataGenerator(self.BRAND_LOGO_PATH, self.settings)
+        self.manual_photo_path = None
+        self.manual_photo_settings = {}
+        # Decoded low resolution copy of the manual tab file, reused while fields change
+        self.preview_source = None
+        self.preview_source_file = None
+        self.prefetch_tasks = []
+        self.current_worker = None
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(50)
+        self.preview_timer.timeout.connect(self.renderManualPreview)
         self.initUI()
         self.createActions()
         self.createMenus()
 
+    def closeEvent(self, event):
+        # Stop the shared exiftool session before the window goes away
+        self.cancelJob()
+        self.cancelPrefetch(None)
+        self.threadpool.waitForDone()
+        self.generator.close()
+        super(MainApp, self).closeEvent(event)
+
     def readBrandPathFiles(self):
         brand_files = os.listdir(self.BRAND_LOGO_PATH)
         # Filtering only the files.
@@ -128,8 +235,10 @@ class MainApp(QMainWindow):
         self.tab_manual_FStop_field.setText(str(settings.get("FNUMBER")))
         self.tab_manual_Exposure_field.setText(str(settings.get("EXPOSURE")))
         self.tab_manual_generate_button.setDisabled(False)
+        self.schedulePreview()
 
-    def updateManualSettings(self):
+    # Manual tab settings for the current file with the edited fields applied
+    def currentManualSettings(self):
         update_dict = {
             "BRAND": self.tab_manual_brand_combobox.currentText(),
             "MODEL": self.tab_manual_Model_field.text(),
@@ -145,8 +254,10 @@ class MainApp(QMainWindow):
             ),
         }
         original_dict = self.manual_photo_settings.get(self.manual_photo_path)
-        updated_dict = {**original_dict, **update_dict}
-        updated_dict = {self.manual_photo_path: updated_dict}
+        return {**original_dict, **update_dict}
+
+    def updateManualSettings(self):
+        updated_dict = {self.manual_photo_path: self.currentManualSettings()}
         debug(
             "DEBUG",
             MainApp.updateManualSettings.__name__,
@@ -159,8 +270,76 @@ class MainApp(QMainWindow):
             ("AF", self.manual_photo_settings),
         )
 
+    # Prepare newly added files in the background so Read Settings is a cache lookup
+    # and Generate only has to compose and save
+    def prefetchFiles(self, files):
+        if not files or not self.settings.getPrefetchSettings()["Enabled"]:
+            return
+        debug("DEBUG", MainApp.prefetchFiles.__name__, files)
+        # Only the first few files are decoded, the rest would push them out of the bounded image cache
+        decode_files = files[: self.settings.getPrefetchSettings()["Max_Images"]]
+        combine_images = self.tab_auto_combine_images_checkbox.checkState() == Qt.Checked
+        preview_side = PREVIEW_SIZE[0] if self.tab_manual_combine_images_checkbox.checkState() == Qt.Checked else None
+        tasks = [
+            PrefetchTask(
+                self.generator, decode_files, combine_images, self.tab_auto_decode_combobox.currentText(), preview_side
+            )
+        ]
+        if len(files) > len(decode_files):
+            # Remaining files only get their metadata cached
+            tasks.append(PrefetchTask(self.generator, files[len(decode_files):], False, None, None))
+        self.prefetch_tasks = [task for task in self.prefetch_tasks if not task.cancelled_all] + tasks
+        for task in tasks:
+            self.threadpool.start(task, -1)
+
+    def cancelPrefetch(self, files):
+        for task in self.prefetch_tasks:
+            task.cancel(files)
+
+    # Re-render the preview shortly after the last field change
+    def schedulePreview(self, *args):
+        if self.manual_photo_settings.get(self.manual_photo_path, None) is None:
+            return
+        self.preview_timer.start()
+
+    # Render the manual tab cover at preview resolution, the full resolution render happens on Generate
+    def renderManualPreview(self):
+        file = self.manual_photo_path
+        if self.manual_photo_settings.get(file, None) is None:
+            return
+        settings = self.currentManualSettings()
+        combine_images = (
+            True
+            if self.tab_manual_combine_images_checkbox.checkState() == Qt.Checked
+            else False
+        )
+        try:
+            source = None
+            if combine_images:
+                if self.preview_source_file != file:
+                    self.preview_source = self.generator.decodeImage(
+                        file, self.generator.previewSourceSize(settings, PREVIEW_SIZE[0]), "draft", settings.get("ORIENTATION")
+                    )
+                    self.preview_source_file = file
+                source = self.preview_source
+            image = self.generator.renderPreview(file, settings, PREVIEW_SIZE, combine_images, source)
+        except Exception as e:
+            debug("ERROR", MainApp.renderManualPreview.__name__, e)
+            return
+        image = image.convert("RGB")
+        self.preview_image_data = image.tobytes("raw", "RGB")
+        preview_image = QImage(
+            self.preview_image_data, image.width, image.height, image.width * 3, QImage.Format_RGB888
+        )
+        self.tab_manual_preview_label.setPixmap(QPixmap.fromImage(preview_image))
+
+    # func is called on the worker thread with the job's cancellation token
     def createComputationTask(self, func, completed_callback):
-        worker = Worker(func)
+        cancel_token = CancellationToken()
+        worker = Worker(func, cancel_token)
+        worker.setCancellationToken(cancel_token)
+        self.current_worker = worker
+        self.job_pause_button.setText("Pause")
         callback = worker.getProgressSignal()
         self.generator.connectProgressCallback(callback)
         worker.signals.finished.connect(completed_callback)
@@ -174,10 +353,37 @@ class MainApp(QMainWindow):
     def showProgressBar(self):
         self.progress_bar.show()
         self.progress_bar_label.show()
+        self.job_controls.show()
 
     def hideProgressBar(self):
         self.progress_bar.hide()
         self.progress_bar_label.hide()
+        self.job_controls.hide()
+        self.current_worker = None
+
+    def toggleJobPause(self):
+        if self.current_worker is None:
+            return
+        if self.current_worker.cancel_token.isPaused():
+            self.current_worker.resume()
+            self.job_pause_button.setText("Pause")
+        else:
+            self.current_worker.pause()
+            self.job_pause_button.setText("Resume")
+
+    def cancelJob(self):
+        if self.current_worker is None:
+            return
+        self.current_worker.cancel()
+        self.job_pause_button.setText("Pause")
+
+    # Put back the files a cancelled auto generation did not get to, generating again resumes the batch
+    def finishAutoGeneration(self):
+        report = self.generator.job_report
+        if report["cancelled"] and report["remaining"]:
+            debug("DEBUG", MainApp.finishAutoGeneration.__name__, ("REMAINING", report["remaining"]))
+            self.files_combobox.addItems(report["remaining"])
+        self.hideProgressBar()
 
     def generateSingleCover(self):
         current_index = self.files_combobox.currentIndex()
@@ -224,8 +430,9 @@ class MainApp(QMainWindow):
             if self.tab_manual_combine_images_checkbox.checkState() == Qt.Checked
             else False
         )
+        decode_quality = self.tab_manual_decode_combobox.currentText()
         self.createComputationTask(
-            lambda: self.generator.execSettings(self.manual_photo_settings, show_images, combine_images),
+            lambda cancel_token: self.generator.execSettings(self.manual_photo_settings, show_images, combine_images, decode_quality, cancel_token, force=True),
             self.hideProgressBar
         )
 
@@ -245,9 +452,15 @@ class MainApp(QMainWindow):
             else False
         )
 
+        force = (
+            True
+            if self.tab_auto_force_checkbox.checkState() == Qt.Checked
+            else False
+        )
+        decode_quality = self.tab_auto_decode_combobox.currentText()
         self.createComputationTask(
-            lambda: self.generator.exec(files, show_images, combine_images), 
-            self.hideProgressBar
+            lambda cancel_token: self.generator.exec(files, show_images, combine_images, decode_quality, cancel_token, force=force),
+            self.finishAutoGeneration
         )
 
     def createActions(self):
@@ -282,6 +495,7 @@ class MainApp(QMainWindow):
             options=options,
         )
         self.files_combobox.addItems(fileName)
+        self.prefetchFiles(fileName)
         # if fileName:
         #     image = QImage(fileName)
         #     if image.isNull():
@@ -319,6 +533,24 @@ class MainApp(QMainWindow):
         )
         self.tab_auto_generate.layout.addWidget(self.tab_auto_combine_images_checkbox)
 
+        # Check box to regenerate covers that are unchanged since they were last generated
+        self.tab_auto_force_checkbox = QCheckBox(self.tab_auto_generate)
+        self.tab_auto_force_checkbox.setText("Regenerate Unchanged Covers")
+        self.tab_auto_generate.layout.addWidget(self.tab_auto_force_checkbox)
+
+        # RAW decode quality used when combining original images
+        self.tab_auto_group_decode = QWidget(self.tab_auto_generate)
+        self.tab_auto_group_decode.layout = QHBoxLayout()
+        self.tab_auto_decode_label = QLabel(self.tab_auto_group_decode)
+        self.tab_auto_decode_label.setText("RAW Decode Quality")
+        self.tab_auto_decode_combobox = QComboBox(self.tab_auto_group_decode)
+        self.tab_auto_decode_combobox.addItems(DECODE_QUALITIES)
+        self.tab_auto_decode_combobox.setCurrentText(self.settings.getDecodeQuality())
+        self.tab_auto_group_decode.layout.addWidget(self.tab_auto_decode_label)
+        self.tab_auto_group_decode.layout.addWidget(self.tab_auto_decode_combobox)
+        self.tab_auto_group_decode.setLayout(self.tab_auto_group_decode.layout)
+        self.tab_auto_generate.layout.addWidget(self.tab_auto_group_decode)
+
         # Generate button to generate single camera settings photo selected in combobox
         self.tab_auto_generate_button = QPushButton(self.tab_auto_generate)
         self.tab_auto_generate_button.setText("Generate")
@@ -448,6 +680,34 @@ class MainApp(QMainWindow):
             self.tab_manual_combine_images_checkbox
         )
 
+        # RAW decode quality used when combining original images
+        self.tab_manual_group_decode = QWidget(self.tab_manual_generate)
+        self.tab_manual_group_decode.layout = QHBoxLayout()
+        self.tab_manual_decode_label = QLabel(self.tab_manual_group_decode)
+        self.tab_manual_decode_label.setText("RAW Decode Quality")
+        self.tab_manual_decode_combobox = QComboBox(self.tab_manual_group_decode)
+        self.tab_manual_decode_combobox.addItems(DECODE_QUALITIES)
+        self.tab_manual_decode_combobox.setCurrentText(self.settings.getDecodeQuality())
+        self.tab_manual_group_decode.layout.addWidget(self.tab_manual_decode_label)
+        self.tab_manual_group_decode.layout.addWidget(self.tab_manual_decode_combobox)
+        self.tab_manual_group_decode.setLayout(self.tab_manual_group_decode.layout)
+        self.tab_manual_generate.layout.addWidget(self.tab_manual_group_decode)
+
+        # Preview of the cover with the current settings, updated as fields change
+        self.tab_manual_preview_label = QLabel(self.tab_manual_generate)
+        self.tab_manual_preview_label.setAlignment(Qt.AlignCenter)
+        self.tab_manual_preview_label.setMinimumSize(PREVIEW_SIZE[0] // 2, PREVIEW_SIZE[1] // 2)
+        self.tab_manual_generate.layout.addWidget(self.tab_manual_preview_label)
+        self.tab_manual_brand_combobox.currentIndexChanged.connect(self.schedulePreview)
+        self.tab_manual_Model_field.textChanged.connect(self.schedulePreview)
+        self.tab_manual_Focal_field.textChanged.connect(self.schedulePreview)
+        self.tab_manual_ISO_field.textChanged.connect(self.schedulePreview)
+        self.tab_manual_FStop_field.textChanged.connect(self.schedulePreview)
+        self.tab_manual_Exposure_field.textChanged.connect(self.schedulePreview)
+        self.tab_manual_Rotation_field.currentIndexChanged.connect(self.schedulePreview)
+        self.tab_manual_mirror_images_checkbox.stateChanged.connect(self.schedulePreview)
+        self.tab_manual_combine_images_checkbox.stateChanged.connect(self.schedulePreview)
+
         # Generate button to generate single camera settings photo selected in combobox
         self.tab_manual_generate_button = QPushButton(self.tab_manual_generate)
         self.tab_manual_generate_button.setText("Generate")
@@ -464,6 +724,8 @@ class MainApp(QMainWindow):
         self.files_label = QLabel("Drag & Drop files here or open from File Menu")
         self.files_combobox = combo("Files", self)
         self.files_combobox.move(100, 20)
+        self.files_combobox.filesAdded.connect(self.prefetchFiles)
+        self.files_combobox.filesRemoved.connect(self.cancelPrefetch)
         layout.addWidget(self.files_label)
         layout.addWidget(self.files_combobox)
 
@@ -483,8 +745,23 @@ class MainApp(QMainWindow):
         # Connect generator class to progress bar in order to update the progress of generation
         self.generator.connectToProgressBar(self.progress_bar)
 
+        # Pause and cancel buttons for the running generation
+        self.job_controls = QWidget(self)
+        self.job_controls.layout = QHBoxLayout()
+        self.job_pause_button = QPushButton(self.job_controls)
+        self.job_pause_button.setText("Pause")
+        self.job_pause_button.clicked.connect(self.toggleJobPause)
+        self.job_cancel_button = QPushButton(self.job_controls)
+        self.job_cancel_button.setText("Cancel")
+        self.job_cancel_button.clicked.connect(self.cancelJob)
+        self.job_controls.layout.addWidget(self.job_pause_button)
+        self.job_controls.layout.addWidget(self.job_cancel_button)
+        self.job_controls.setLayout(self.job_controls.layout)
+        self.job_controls.hide()
+
         layout.addWidget(self.progress_bar)
         layout.addWidget(self.progress_bar_label)
+        layout.addWidget(self.job_controls)
 
         # self.setLayout(layout)
         # self.setGeometry(200,200,400,200)
@@ -495,6 +772,8 @@ class MainApp(QMainWindow):
         # self.resize(800, 600)
 
 def main():
+    # Required for the cover generation process pool in the packaged exe
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     ex = MainApp()
     ex.show()
@@ -0,0 +1,310 @@
+import argparse
+import glob
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Generation pipeline benchmark on synthetic images, runs offline without exiftool or RAW files, e.g.
+#   python benchmarks/pipeline.py --save-baseline
+#   python benchmarks/pipeline.py --sizes 12,24,45 --formats jpeg,tiff --modes combine --workers 4
+# Inputs are generated at each megapixel size and format, camera settings come from stub metadata
+# Every case runs in a fresh interpreter so its peak memory is its own
+# Throughput is compared against the stored baseline, exits with 1 when a case is slower than the tolerance allows
+# Baselines are machine specific, save one on the machine the comparison runs on
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_PATH)
+
+DEFAULT_BASELINE_PATH = os.path.join(REPO_PATH, "benchmarks", "pipeline_baseline.json")
+
+INPUT_FORMATS = {"jpeg": ".jpg", "png": ".png", "tiff": ".tif"}
+
+# metadata reads through the metadata cache, exif parses the EXIF of the JPEG inputs with the native reader
+MODES = ["placeholder", "combine", "metadata", "exif"]
+
+# Common font locations, used when --font is not given and settings.json has no usable font
+FONT_PATTERNS = [
+    "C:/WINDOWS/FONTS/*.ttf",
+    "/usr/share/fonts/**/*.ttf",
+    "/Library/Fonts/*.ttf",
+    "/System/Library/Fonts/**/*.ttf",
+]
+
+
+def findFont(font_path: str = None) -> str:
+    if font_path:
+        return font_path
+    try:
+        with open(os.path.join(REPO_PATH, "settings.json")) as f:
+            default_font = json.load(f)["settings"]["Font"].get("Default_Font")
+        if default_font and os.path.isfile(default_font):
+            return default_font
+    except (OSError, KeyError, ValueError):
+        pass
+    for pattern in FONT_PATTERNS:
+        fonts = sorted(glob.glob(pattern, recursive=True))
+        if fonts:
+            return fonts[0]
+    return None
+
+
+def imageSize(megapixels: float) -> tuple:
+    width = round(math.sqrt(megapixels * 1_000_000 * 3 / 2))
+    return width, round(width * 2 / 3)
+
+
+# Gradient and noise so the encoders and decoders do realistic work, every other file is portrait
+def createInputs(input_path: str, sizes: list, formats: list, images: int) -> dict:
+    from PIL import Image, TiffImagePlugin
+
+    # Same camera settings as the stub metadata, embedded in the JPEG inputs
+    exif = Image.Exif()
+    exif[0x010F] = "Canon"
+    exif[0x0110] = "Canon EOS R6"
+    exif[0x0112] = 1
+    exif_ifd = exif.get_ifd(0x8769)
+    exif_ifd[0x829A] = TiffImagePlugin.IFDRational(1, 250)
+    exif_ifd[0x829D] = TiffImagePlugin.IFDRational(28, 10)
+    exif_ifd[0x8827] = 400
+    exif_ifd[0x920A] = TiffImagePlugin.IFDRational(50, 1)
+
+    metadata = {}
+    for megapixels in sizes:
+        width, height = imageSize(megapixels)
+        base = Image.merge(
+            "RGB",
+            (
+                Image.linear_gradient("L").resize((width, height)),
+                Image.linear_gradient("L").rotate(90).resize((width, height)),
+                Image.effect_noise((width, height), 48),
+            ),
+        )
+        for input_format in formats:
+            for index in range(images):
+                image = base if index % 2 == 0 else base.transpose(Image.ROTATE_90)
+                file = f"{input_path}/{megapixels}mp_{index}{INPUT_FORMATS[input_format]}".replace("\\", "/")
+                if input_format == "png":
+                    image.save(file, compress_level=1)
+                elif input_format == "jpeg":
+                    image.save(file, exif=exif)
+                else:
+                    image.save(file)
+                metadata.setdefault(f"{input_format}/{megapixels}", {})[file] = {
+                    "BRAND": "Canon",
+                    "MODEL": "Canon EOS R6",
+                    "WIDTH": image.width,
+                    "HEIGHT": image.height,
+                    "IMAGECOUNT": None,
+                    "ISO": 400,
+                    "FNUMBER": 2.8,
+                    "EXPOSURE": "1/250",
+                    "FOCALLENGTH": 50,
+                    "ORIENTATION": 1,
+                    "ROTATION": "0",
+                    "MIRROR": False,
+                }
+    return metadata
+
+
+def writeSettings(settings_path: str, output_path: str, font_path: str, workers: int) -> None:
+    settings = {
+        "settings": {
+            "Brand_Logo_Path": os.path.join(REPO_PATH, "logo").replace("\\", "/"),
+            "Output_Path": output_path,
+            "Workers": workers,
+            "Output_Manifest": False,
+            "Metadata_Cache": {"Enabled": True, "Path": os.path.join(os.path.dirname(settings_path), "metadata_cache.sqlite")},
+            "Font": {
+                "Default_Font": font_path,
+                "Font_40": font_path,
+                "Font_60": font_path,
+                "Title_Font_80": font_path,
+                "Model_Font_80": font_path,
+            },
+        }
+    }
+    with open(settings_path, "w") as f:
+        json.dump(settings, f, indent=2)
+
+
+# Body of one case, run in the child interpreter
+def runChildCase(case: dict) -> dict:
+    from etif import AppSettings, MetadataGenerator
+    from profiling import JobProfiler, peakRss
+
+    settings = AppSettings(case["settings_path"])
+    generator = MetadataGenerator(settings.getSettings()["settings"]["Brand_Logo_Path"], settings)
+    generator.show_images = False
+    metadata = case["metadata"]
+    files = list(metadata.keys())
+    try:
+        if case["mode"] == "metadata":
+            # readRawMetadata answered from the metadata cache, exiftool is never started
+            cache = generator.getMetadataCache()
+            for file, data in metadata.items():
+                cache.put(file, data)
+            profiler = JobProfiler()
+            for _ in range(case["repeat"]):
+                with profiler.stage("metadata"):
+                    read_metadata = generator.readRawMetadata(files)
+            profiler.finish()
+            errors = len(files) - len(read_metadata)
+            processed = len(files) * case["repeat"]
+        elif case["mode"] == "exif":
+            # readRawMetadata without the metadata cache, answered by the native EXIF reader
+            settings.getSettings()["settings"]["Metadata_Cache"]["Enabled"] = False
+            profiler = JobProfiler()
+            for _ in range(case["repeat"]):
+                with profiler.stage("metadata"):
+                    read_metadata = generator.readRawMetadata(files)
+            profiler.finish()
+            errors = len(files) - len(read_metadata)
+            processed = len(files) * case["repeat"]
+        else:
+            generator.profiler = profiler = JobProfiler()
+            results = []
+            for _ in range(case["repeat"]):
+                results += generator.generateCover(metadata, case["mode"] == "combine")
+            generator.profiler = None
+            profiler.finish()
+            errors = sum(1 for result in results if result["error"] is not None)
+            processed = len(results)
+    finally:
+        generator.close()
+
+    summary = profiler.summary()
+    return {
+        "images": processed,
+        "errors": errors,
+        "seconds": summary["wall_seconds"],
+        "images_per_second": processed / summary["wall_seconds"],
+        "stages": {
+            name: {"p50_ms": stats["p50"] * 1000, "p95_ms": stats["p95"] * 1000}
+            for name, stats in summary["stages"].items()
+        },
+        "bytes_written": summary["bytes_written"],
+        "peak_rss_mb": peakRss() / 1_000_000 if peakRss() else None,
+        "peak_rss_workers_mb": peakRss(children=True) / 1_000_000 if peakRss(children=True) else None,
+    }
+
+
+def runCase(case: dict) -> dict:
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child"],
+        input=json.dumps(case),
+        capture_output=True,
+        text=True,
+        cwd=REPO_PATH,
+    )
+    if completed.returncode != 0:
+        return {"error": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "failed"}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def readBaseline(baseline_path: str) -> dict:
+    try:
+        with open(baseline_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Measure throughput, stage latency and peak memory of cover generation")
+    parser.add_argument("--sizes", default="12,24", help="comma separated megapixel sizes of the synthetic inputs")
+    parser.add_argument("--formats", default="jpeg,png,tiff", help="comma separated input formats: " + ",".join(INPUT_FORMATS))
+    parser.add_argument("--modes", default=",".join(MODES), help="comma separated modes: " + ",".join(MODES))
+    parser.add_argument("--images", type=int, default=4, help="images per size and format")
+    parser.add_argument("--repeat", type=int, default=1, help="times each case generates its images")
+    parser.add_argument("--workers", type=int, default=1, help="Workers setting used for generation")
+    parser.add_argument("--font", help="TrueType font used for the covers")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="baseline JSON file to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed throughput drop against the baseline")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(runChildCase(json.loads(sys.stdin.read()))))
+        return 0
+
+    font_path = findFont(args.font)
+    if font_path is None:
+        print("No TrueType font found, pass one with --font", file=sys.stderr)
+        return 2
+    sizes = [float(size) if "." in size else int(size) for size in args.sizes.split(",")]
+    formats = [input_format for input_format in args.formats.split(",") if input_format in INPUT_FORMATS]
+    modes = [mode for mode in args.modes.split(",") if mode in MODES]
+    baseline = readBaseline(args.baseline)
+
+    results = []
+    failed = False
+    with tempfile.TemporaryDirectory() as temp_path:
+        temp_path = temp_path.replace("\\", "/")
+        input_path = f"{temp_path}/input"
+        output_path = f"{temp_path}/output"
+        os.makedirs(input_path)
+        os.makedirs(output_path)
+        settings_path = f"{temp_path}/settings.json"
+        writeSettings(settings_path, output_path, font_path, args.workers)
+        inputs = createInputs(input_path, sizes, formats, args.images)
+
+        for mode in modes:
+            for key, metadata in inputs.items():
+                if mode == "exif" and not key.startswith("jpeg/"):
+                    continue
+                name = f"{mode}/{key}mp"
+                result = runCase(
+                    {"mode": mode, "metadata": metadata, "settings_path": settings_path, "repeat": max(1, args.repeat)}
+                )
+                result["case"] = name
+                if "error" not in result:
+                    baseline_ips = baseline.get(name, {}).get("images_per_second")
+                    result["baseline_images_per_second"] = baseline_ips
+                    result["passed"] = result["errors"] == 0 and (
+                        baseline_ips is None or result["images_per_second"] >= baseline_ips * (1 - args.tolerance)
+                    )
+                    failed = failed or not result["passed"]
+                else:
+                    failed = True
+                results.append(result)
+
+    if args.save_baseline:
+        baseline.update(
+            {
+                result["case"]: {"images_per_second": result["images_per_second"], "saved": time.strftime("%Y-%m-%d %H:%M:%S")}
+                for result in results
+                if "error" not in result
+            }
+        )
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            if "error" in result:
+                print(f"{result['case']:>24} | ERROR | {result['error']}")
+                continue
+            status = "OK" if result["passed"] else "FAIL"
+            compared = ""
+            if result["baseline_images_per_second"]:
+                change = result["images_per_second"] / result["baseline_images_per_second"] - 1
+                compared = f" ({change:+.0%} vs baseline)"
+            peak_mb = max(result["peak_rss_mb"] or 0, result["peak_rss_workers_mb"] or 0)
+            stages = ", ".join(f"{name} {stats['p50_ms']:.0f}/{stats['p95_ms']:.0f}" for name, stats in result["stages"].items())
+            print(
+                f"{result['case']:>24} | {status:>4} | {result['images_per_second']:7.2f} img/s{compared}"
+                f" | peak {peak_mb:.0f} MB | p50/p95 ms: {stages}"
+            )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Cold start benchmark for the generator and GUI modules
+# Each case runs in a fresh interpreter so nothing is already imported, e.g.
+#   python benchmarks/startup.py
+#   python benchmarks/startup.py --runs 10 --json
+# Exits with 1 when a median exceeds its budget or a heavy module is loaded too early
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be imported by the code paths that need them
+LAZY_MODULES = ["PyQt5", "rawpy", "exiftool", "numpy", "skimage", "sqlite3", "concurrent.futures.process"]
+
+# name, statement timed in the child interpreter, budget in milliseconds, whether lazy modules are checked
+CASES = [
+    ("import etif", "import etif", 200, True),
+    ("import cli", "import cli", 200, True),
+    ("import app_py", "import app_py", 1000, False),
+]
+
+CHILD_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, {repo_path!r})
+start = time.perf_counter()
+{statement}
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({{"ms": elapsed, "modules": [m for m in {lazy_modules!r} if m in sys.modules]}}))
+"""
+
+
+def runCase(statement: str) -> dict:
+    script = CHILD_SCRIPT.format(repo_path=REPO_PATH, statement=statement, lazy_modules=LAZY_MODULES)
+    completed = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, cwd=REPO_PATH)
+    if completed.returncode != 0:
+        return {"error": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "failed"}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Measure cold import time of the generator modules")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per case")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = []
+    failed = False
+    for name, statement, budget_ms, check_lazy in CASES:
+        runs = [runCase(statement) for _ in range(args.runs)]
+        errors = [run["error"] for run in runs if "error" in run]
+        if errors:
+            # Optional dependency such as PyQt5 is not installed here
+            results.append({"case": name, "skipped": errors[0]})
+            continue
+        median_ms = statistics.median(run["ms"] for run in runs)
+        loaded = sorted(set(module for run in runs for module in run["modules"])) if check_lazy else []
+        passed = median_ms <= budget_ms and not loaded
+        failed = failed or not passed
+        results.append(
+            {
+                "case": name,
+                "median_ms": round(median_ms, 1),
+                "budget_ms": budget_ms,
+                "eagerly_loaded": loaded,
+                "passed": passed,
+            }
+        )
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            if "skipped" in result:
+                print(f"{result['case']:>15} | SKIPPED | {result['skipped']}")
+                continue
+            status = "OK" if result["passed"] else "FAIL"
+            loaded = f" | loaded early: {', '.join(result['eagerly_loaded'])}" if result["eagerly_loaded"] else ""
+            print(f"{result['case']:>15} | {status:>4} | {result['median_ms']:>7.1f} ms / {result['budget_ms']} ms{loaded}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
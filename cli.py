@@ -0,0 +1,193 @@
+import argparse
+import glob
+import json
+import os
+import signal
+import sys
+import time
+from etif import AppSettings, MetadataGenerator, DECODE_QUALITIES, IMAGE_EXTENSIONS
+
+# Headless batch entry point, e.g.
+#   python cli.py "J:/2024_03/**/*.CR2" J:/DCIM --workers 8 --combine --json
+#   python cli.py --manifest job.json
+#   python cli.py J:/DCIM --profile profile.json --trace trace.json
+# Manifest format, overrides use the same keys as the Manual tab:
+#   {
+#     "combine_original_images": true,
+#     "decode_quality": "balanced",
+#     "files": [
+#       "J:/DCIM/IMG_0001.CR2",
+#       {"path": "J:/DCIM/IMG_0002.CR2", "overrides": {"ROTATION": "90", "MIRROR": false, "MODEL": "Canon EOS R6"}}
+#     ]
+#   }
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Generate camera settings covers without the GUI")
+    parser.add_argument("inputs", nargs="*", help="image files, directories or glob patterns")
+    parser.add_argument("--manifest", help="JSON job manifest with files and per-file overrides")
+    parser.add_argument("--settings", default=os.getcwd() + "/settings.json", help="path to settings.json")
+    parser.add_argument("--output", help="output directory, defaults to Output_Path in settings")
+    parser.add_argument("--workers", type=int, help="number of worker processes, 0 uses one per CPU core")
+    parser.add_argument("--combine", action="store_true", default=None, help="combine original images with the cover")
+    parser.add_argument("--decode-quality", choices=DECODE_QUALITIES, help="RAW decode tier")
+    parser.add_argument("--force", action="store_true", help="regenerate covers that are unchanged since the last run")
+    parser.add_argument("--recursive", action="store_true", help="search directories recursively")
+    parser.add_argument("--json", action="store_true", help="print one JSON object per line for progress")
+    parser.add_argument("--profile", help="write per-stage timings and aggregate stats of the job to this JSON file")
+    parser.add_argument("--trace", help="write a Chrome trace of the job stages to this file")
+    parser.add_argument("--cprofile", help="profile the job with cProfile and write the stats to this file")
+    return parser.parse_args(argv)
+
+
+# Expand files, directories and glob patterns into supported image files, keeping order and dropping duplicates
+def collectFiles(inputs: list, recursive: bool = False) -> list:
+    files = []
+    for pattern in inputs:
+        pattern = pattern.replace("\\", "/")
+        if os.path.isdir(pattern):
+            if recursive:
+                candidates = [
+                    os.path.join(root, name)
+                    for root, _, names in os.walk(pattern)
+                    for name in sorted(names)
+                ]
+            else:
+                candidates = [os.path.join(pattern, name) for name in sorted(os.listdir(pattern))]
+        elif os.path.isfile(pattern):
+            candidates = [pattern]
+        else:
+            candidates = sorted(glob.glob(pattern, recursive=True))
+        for candidate in candidates:
+            candidate = candidate.replace("\\", "/")
+            if os.path.isfile(candidate) and os.path.splitext(candidate)[1].lower() in IMAGE_EXTENSIONS:
+                files.append(candidate)
+    return list(dict.fromkeys(files))
+
+
+def readManifest(manifest_path: str) -> tuple:
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    files = []
+    overrides = {}
+    for entry in manifest.get("files", []):
+        if isinstance(entry, str):
+            files.append(entry.replace("\\", "/"))
+        else:
+            path = entry["path"].replace("\\", "/")
+            files.append(path)
+            if entry.get("overrides"):
+                overrides[path] = entry["overrides"]
+    return files, overrides, manifest
+
+
+def report(as_json: bool, event: dict) -> None:
+    if as_json:
+        print(json.dumps(event), flush=True)
+    elif event["event"] == "file":
+        status = event["output"] if event["error"] is None else "ERROR " + event["error"]
+        if event.get("skipped"):
+            status += " (unchanged)"
+        print(f"[{event['index']}/{event['total']}] {event['file']} -> {status}", flush=True)
+    elif event["event"] == "summary":
+        print(
+            f"{event['succeeded'] - event['skipped']} generated, {event['skipped']} unchanged, {event['failed']} failed in {event['seconds']:.1f}s",
+            flush=True,
+        )
+
+
+# Generate covers for files as one profiled job, reporting every file and a summary
+# start is when the job began for the summary, e.g. before files were collected; returns the number of failed files
+def generateFiles(generator: MetadataGenerator, files: list, combine_original_images: bool, as_json: bool, metadata: dict = None, start: float = None) -> int:
+    start = time.perf_counter() if start is None else start
+    failed = 0
+    skipped = 0
+    generator.startProfiling()
+    try:
+        for index, result in enumerate(generator.iterGenerate(files, combine_original_images, metadata), start=1):
+            if result["error"] is not None:
+                failed += 1
+            elif result.get("skipped"):
+                skipped += 1
+            report(as_json, {"event": "file", "index": index, "total": len(files), **result})
+    finally:
+        generator.finishProfiling()
+    report(
+        as_json,
+        {
+            "event": "summary",
+            "total": len(files),
+            "succeeded": len(files) - failed,
+            "skipped": skipped,
+            "failed": failed,
+            "seconds": time.perf_counter() - start,
+        },
+    )
+    return failed
+
+
+# Stop a long-running entry point on SIGTERM the way Ctrl+C does, so worker processes and exiftool are shut down
+# Worker processes inherit the handler and leave stopping to the process that installed it
+def stopOnTerminate() -> None:
+    main_pid = os.getpid()
+
+    def stop(signum, frame) -> None:
+        if os.getpid() == main_pid:
+            raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+
+
+def main(argv=None) -> int:
+    args = parseArguments(argv)
+    start = time.perf_counter()
+
+    files = collectFiles(args.inputs, args.recursive)
+    overrides = {}
+    manifest = {}
+    if args.manifest:
+        manifest_files, overrides, manifest = readManifest(args.manifest)
+        files = list(dict.fromkeys(files + manifest_files))
+    if not files:
+        print("No input files found", file=sys.stderr)
+        return 2
+
+    # An interrupted run still writes the output manifest, so a rerun skips the covers it finished
+    stopOnTerminate()
+    settings = AppSettings(args.settings)
+    if args.output:
+        settings.getSettings()["settings"]["Output_Path"] = args.output.replace("\\", "/")
+    os.makedirs(settings.getOutputPath(), exist_ok=True)
+    if args.profile or args.trace or args.cprofile:
+        settings.getSettings()["settings"]["Profiling"] = {
+            "Enabled": True,
+            "Report_Path": args.profile or "",
+            "Trace_Path": args.trace or "",
+            "CProfile_Path": args.cprofile or "",
+        }
+    generator = MetadataGenerator(settings.getSettings().get("settings").get("Brand_Logo_Path"), settings)
+    generator.show_images = False
+    if args.workers is not None:
+        generator.workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    combine_original_images = args.combine if args.combine is not None else manifest.get("combine_original_images", False)
+    generator.decode_quality = args.decode_quality or manifest.get("decode_quality") or settings.getDecodeQuality()
+    generator.force = args.force
+
+    try:
+        # Files with overrides need their metadata up front so the overrides can be merged in
+        metadata = {}
+        if overrides:
+            read_metadata = generator.readRawMetadata(list(overrides.keys()))
+            for file, override in overrides.items():
+                if file in read_metadata:
+                    metadata[file] = {**read_metadata[file], **override}
+        failed = generateFiles(generator, files, combine_original_images, args.json, metadata, start)
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        generator.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,19 @@
-from exiftool import ExifToolHelper
-from PIL import Image, ImageDraw, ImageFont, ImageOps
-from PyQt5.QtWidgets import QProgressBar, QApplication
-from skimage.io import imread
-from skimage.transform import resize
-import rawpy
+from PIL import Image, ImageDraw, ImageOps, features
+from resource_cache import loadFont, loadLogo, loadScaledLogo, loadFooter, measureText
+from pipeline import StagedPipeline, CancellationToken, JobCancelled
+from output_manifest import OutputManifest
+from profiling import JobProfiler
+from tiled_cover import TiledCover, SolidImage
+from exif_reader import readExifTags
+from contextlib import nullcontext
+from collections import deque, OrderedDict
+import io
 import os
 import json
+import signal
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
 # from app_py import AppSettings
 
 # LIB: rawpy
@@ -26,6 +34,47 @@ import json
 #             print(f"Dict: {k} = {v}")
 
 DEBUG_MODE = False
+# Image files accepted as generator input
+IMAGE_EXTENSIONS = [".png", ".jpeg", ".jpg", ".bmp", ".cr2", ".raf", ".raw", ".tiff", ".tif"]
+# Files decoded with rawpy instead of Pillow
+RAW_EXTENSIONS = [".cr2", ".raf", ".raw", ".nef", ".arw", ".dng", ".orf", ".rw2"]
+# Cover output formats and their file extensions
+OUTPUT_FORMATS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+# Added to the name of a cover that would otherwise replace the image it was made from
+COVER_SUFFIX = "_cover"
+# RAW decode tiers, from fastest to best looking
+DECODE_QUALITIES = ["draft", "balanced", "quality"]
+
+# Pillow transposes as 2x2 matrices acting on pixel offsets from the image centre, with y pointing down
+TRANSPOSE_MATRICES = {
+    None: ((1, 0), (0, 1)),
+    Image.FLIP_LEFT_RIGHT: ((-1, 0), (0, 1)),
+    Image.FLIP_TOP_BOTTOM: ((1, 0), (0, -1)),
+    Image.ROTATE_90: ((0, 1), (-1, 0)),
+    Image.ROTATE_180: ((-1, 0), (0, -1)),
+    Image.ROTATE_270: ((0, -1), (1, 0)),
+    Image.TRANSPOSE: ((0, 1), (1, 0)),
+    Image.TRANSVERSE: ((0, -1), (-1, 0)),
+}
+
+# EXIF Orientation values and the transpose that turns the stored pixels upright
+EXIF_ORIENTATION_TRANSPOSES = {
+    1: None,
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+
+# Tags the native EXIF reader must find for a file, anything less is read with exiftool instead
+NATIVE_REQUIRED_TAGS = ["Make", "Model", "FNumber", "ExposureTime", "FocalLength"]
+
+# Counter-clockwise quarter turns of the ROTATION setting
+QUARTER_TURN_TRANSPOSES = [None, Image.ROTATE_90, Image.ROTATE_180, Image.ROTATE_270]
+
 def debug(error_code, func_name, message):
     if not DEBUG_MODE:
         return
@@ -59,6 +108,127 @@ class AppSettings():
             "Model_Font_80": self.settings["settings"]["Font"].get("Model_Font_80", None),
         }
 
+    # Default RAW decode tier used when a job does not choose one
+    def getDecodeQuality(self) -> str:
+        decode_quality = self.settings["settings"].get("Decode_Quality", "quality")
+        return decode_quality if decode_quality in DECODE_QUALITIES else "quality"
+
+    # Cover encoder settings, Compression_Level applies to PNG (0-9) and Method to WebP (0 fastest - 6 smallest)
+    def getOutputSettings(self):
+        output_settings = self.settings["settings"].get("Output", {})
+        output_format = str(output_settings.get("Format", "png")).lower()
+        if output_format == "jpg":
+            output_format = "jpeg"
+        return {
+            "Format": output_format if output_format in OUTPUT_FORMATS else "png",
+            "Quality": int(output_settings.get("Quality", 90)),
+            "Compression_Level": int(output_settings.get("Compression_Level", 6)),
+            "Method": int(output_settings.get("Method", 4)),
+            "Optimize": bool(output_settings.get("Optimize", False)),
+            "Progressive": bool(output_settings.get("Progressive", False)),
+            "Lossless": bool(output_settings.get("Lossless", False)),
+        }
+
+    # Number of threads serving each stage of in-process generation, and the number of files in flight
+    def getPipelineSettings(self):
+        pipeline_settings = self.settings["settings"].get("Pipeline", {})
+        return {
+            "Metadata": int(pipeline_settings.get("Metadata", 1)),
+            "Decode": int(pipeline_settings.get("Decode", 2)),
+            "Compose": int(pipeline_settings.get("Compose", 1)),
+            "Save": int(pipeline_settings.get("Save", 2)),
+            "Max_In_Flight": int(pipeline_settings.get("Max_In_Flight", 4)),
+        }
+
+    # Skip covers whose source file, metadata and render settings did not change since they were generated
+    def getOutputManifestEnabled(self) -> bool:
+        return bool(self.settings["settings"].get("Output_Manifest", True))
+
+    # Files per exiftool call and the number of exiftool processes reading chunks in parallel
+    def getExiftoolSettings(self):
+        exiftool_settings = self.settings["settings"].get("Exiftool", {})
+        return {
+            "Chunk_Size": int(exiftool_settings.get("Chunk_Size", 200)),
+            "Sessions": max(1, int(exiftool_settings.get("Sessions", 2))),
+        }
+
+    # Background preparation of files added to the GUI, Max_Images bounds the decoded images kept in memory
+    def getPrefetchSettings(self):
+        prefetch_settings = self.settings["settings"].get("Prefetch", {})
+        return {
+            "Enabled": prefetch_settings.get("Enabled", True),
+            "Max_Images": max(0, int(prefetch_settings.get("Max_Images", 4))),
+        }
+
+    # Metadata cache is stored next to settings.json unless a path is given
+    def getMetadataCacheSettings(self):
+        cache_settings = self.settings["settings"].get("Metadata_Cache", {})
+        default_path = os.path.join(os.path.dirname(os.path.abspath(self.settings_path)), "metadata_cache.sqlite")
+        return {
+            "Enabled": cache_settings.get("Enabled", True),
+            "Path": cache_settings.get("Path") or default_path,
+            "Max_Entries": int(cache_settings.get("Max_Entries", 50000)),
+        }
+
+    # Covers of at least Min_Megapixels saved as PNG are composited and encoded Strip_Height rows at a time
+    def getTiledCompositingSettings(self):
+        tiled_settings = self.settings["settings"].get("Tiled_Compositing", {})
+        return {
+            "Enabled": tiled_settings.get("Enabled", True),
+            "Min_Megapixels": float(tiled_settings.get("Min_Megapixels", 50)),
+            "Strip_Height": max(1, int(tiled_settings.get("Strip_Height", 256))),
+        }
+
+    # Read JPEG, TIFF and CR2 metadata in-process, exiftool is only started for other formats
+    def getNativeExifReaderEnabled(self) -> bool:
+        return bool(self.settings["settings"].get("Native_Exif_Reader", True))
+
+    # Per-stage timings of each job, written as a JSON report and a Chrome trace when their paths are set
+    # CProfile_Path additionally profiles the job with cProfile, which runs the stages on a single thread
+    def getProfilingSettings(self):
+        profiling_settings = self.settings["settings"].get("Profiling", {})
+        return {
+            "Enabled": profiling_settings.get("Enabled", False),
+            "Report_Path": profiling_settings.get("Report_Path", ""),
+            "Trace_Path": profiling_settings.get("Trace_Path", ""),
+            "CProfile_Path": profiling_settings.get("CProfile_Path", ""),
+        }
+
+    # Folders watched by watch.py, a file is generated once its size and modification time held for Settle_Seconds
+    # Polling compares directory listings every Poll_Interval seconds instead of using inotify
+    def getWatchSettings(self):
+        watch_settings = self.settings["settings"].get("Watch", {})
+        return {
+            "Directories": list(watch_settings.get("Directories", [])),
+            "Recursive": watch_settings.get("Recursive", True),
+            "Settle_Seconds": max(0.0, float(watch_settings.get("Settle_Seconds", 2))),
+            "Poll_Interval": max(0.1, float(watch_settings.get("Poll_Interval", 1))),
+            "Polling": watch_settings.get("Polling", False),
+            "Combine_Original_Images": watch_settings.get("Combine_Original_Images", False),
+            "Process_Existing": watch_settings.get("Process_Existing", False),
+        }
+
+    # Local render service of server.py, Concurrency covers render at once (0 or less: one per worker)
+    # and up to Max_Queue requests wait at most Queue_Timeout seconds for a slot before being turned away
+    def getServerSettings(self):
+        server_settings = self.settings["settings"].get("Server", {})
+        concurrency = int(server_settings.get("Concurrency", 0))
+        return {
+            "Host": server_settings.get("Host", "127.0.0.1"),
+            "Port": int(server_settings.get("Port", 8765)),
+            "Concurrency": concurrency if concurrency > 0 else self.getWorkerCount(),
+            "Max_Queue": max(0, int(server_settings.get("Max_Queue", 16))),
+            "Queue_Timeout": float(server_settings.get("Queue_Timeout", 30)),
+            "Combine_Original_Images": server_settings.get("Combine_Original_Images", False),
+        }
+
+    # Number of worker processes used to generate covers, 0 or less means one per CPU core
+    def getWorkerCount(self) -> int:
+        workers = int(self.settings["settings"].get("Workers", 1))
+        if workers <= 0:
+            workers = os.cpu_count() or 1
+        return workers
+
 class MetadataGenerator:
     def __init__(self, brand_logo_path, settings: AppSettings) -> None:
         self.brand_logo_path = brand_logo_path
@@ -67,31 +237,216 @@ class MetadataGenerator:
         self.FOOTER_HEIGHT = 200
         self.PADDING_WIDTH = 60
         self.connected_progress_bar = False
+        self.connected_progress_callback = False
         self.show_images = True
         self.progress_callback = None
+        self.workers = settings.getWorkerCount()
+        self.decode_quality = settings.getDecodeQuality()
+        self.output_settings = settings.getOutputSettings()
+        self.tiled_settings = settings.getTiledCompositingSettings()
+        # Regenerate covers even when the output manifest says they are current
+        self.force = False
+        self.output_manifests = {}
+        self.output_manifests_lock = threading.Lock()
+        # Cancellation token of the running job, and what the last job completed
+        self.cancel_token = None
+        self.job_report = {"completed": {}, "failed": {}, "remaining": [], "cancelled": False}
+        # Long-lived exiftool processes, started on demand up to the Sessions setting and shared by every caller
+        self.exiftool_settings = settings.getExiftoolSettings()
+        self.exiftool_idle = queue.Queue()
+        self.exiftool_sessions = []
+        self.exiftool_lock = threading.Lock()
+        # Images decoded ahead of time by prefetchFile, handed over once to decodeImage
+        self.decoded_images = OrderedDict()
+        self.decoded_images_lock = threading.Lock()
+        self.max_decoded_images = settings.getPrefetchSettings()["Max_Images"]
+        # On-disk metadata cache, opened on first use so worker processes never touch it
+        self.metadata_cache = None
+        self.metadata_cache_lock = threading.Lock()
+        # Stage timings of the running job, only set while profiling
+        self.profiler = None
+        # Worker processes kept between jobs by long-running callers, started with startProcessPool
+        self.process_pool = None
+
+    # Take an idle exiftool session, starting a new one while below the session limit, otherwise wait for one
+    # Sessions must be handed back with releaseExifTool
+    def acquireExifTool(self) -> "ExifToolHelper":
+        try:
+            return self.exiftool_idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.exiftool_lock:
+            start_session = len(self.exiftool_sessions) < self.exiftool_settings["Sessions"]
+            if start_session:
+                # exiftool is only loaded once metadata is actually read
+                from exiftool import ExifToolHelper
+
+                debug("DEBUG", MetadataGenerator.acquireExifTool.__name__, "STARTING EXIFTOOL SESSION")
+                et = ExifToolHelper()
+                et.run()
+                self.exiftool_sessions.append(et)
+                return et
+        return self.exiftool_idle.get()
+
+    def releaseExifTool(self, et: "ExifToolHelper") -> None:
+        if not et.running:
+            # Session died while reading, let a new one take its place
+            with self.exiftool_lock:
+                if et in self.exiftool_sessions:
+                    self.exiftool_sessions.remove(et)
+            return
+        self.exiftool_idle.put(et)
+
+    # Return the metadata cache, or None when caching is disabled or the cache cannot be opened
+    def getMetadataCache(self):
+        with self.metadata_cache_lock:
+            if self.metadata_cache is None:
+                cache_settings = self.settings.getMetadataCacheSettings()
+                if not cache_settings["Enabled"]:
+                    return None
+                try:
+                    from metadata_cache import MetadataCache
+
+                    self.metadata_cache = MetadataCache(cache_settings["Path"], cache_settings["Max_Entries"])
+                except Exception as e:
+                    debug("ERROR", MetadataGenerator.getMetadataCache.__name__, ("METADATA CACHE DISABLED", e))
+                    return None
+            return self.metadata_cache
+
+    # Start what the first cover of a job would otherwise wait for: exiftool, the metadata cache, fonts and,
+    # when generating in parallel, the worker processes
+    # Long-running callers such as watch.py and server.py call this once, every later job starts warm
+    def warmUp(self) -> None:
+        self.getMetadataCache()
+        self.loadResources()
+        if self.workers > 1:
+            self.startProcessPool()
+        try:
+            self.releaseExifTool(self.acquireExifTool())
+        except (ImportError, OSError) as e:
+            debug("ERROR", MetadataGenerator.warmUp.__name__, ("EXIFTOOL UNAVAILABLE", e))
+
+    # Load the title fonts and every brand logo into the resource cache of this process
+    def loadResources(self) -> None:
+        loadFont(self.settings_dict.get("Title_Font_80", self.settings_dict["Default_Font"]), 80)
+        loadFont(self.settings_dict.get("Model_Font_80", self.settings_dict["Default_Font"]), 80)
+        if self.brand_logo_path and os.path.isdir(self.brand_logo_path):
+            for logo_file in sorted(os.listdir(self.brand_logo_path)):
+                brand, extension = os.path.splitext(logo_file)
+                if extension == ".png":
+                    loadLogo(self.brand_logo_path, brand)
+
+    # Keep a pool of worker processes for every parallel job until close
+    # Every worker is started and has its resources loaded before this returns
+    def startProcessPool(self) -> None:
+        if self.process_pool is not None:
+            return
+        from concurrent.futures import ProcessPoolExecutor, wait
+
+        self.process_pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_initCoverWorker,
+            initargs=(self.brand_logo_path, self.settings),
+        )
+        wait([self.process_pool.submit(_warmUpCoverWorker) for _ in range(self.workers)])
+
+    # Render one cover in the worker pool kept by startProcessPool, returns the Future of its result dict
+    def submitCover(self, file: str, data: dict, combine_original_images: bool = False):
+        return self.process_pool.submit(_renderCoverTask, file, data, combine_original_images, self.decode_quality)
+
+    # Shut down the exiftool session and metadata cache, called when the app closes
+    def close(self) -> None:
+        self.saveOutputManifests()
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=True, cancel_futures=True)
+            self.process_pool = None
+        with self.exiftool_lock:
+            for et in self.exiftool_sessions:
+                if et.running:
+                    debug("DEBUG", MetadataGenerator.close.__name__, "STOPPING EXIFTOOL SESSION")
+                    et.terminate()
+            self.exiftool_sessions = []
+            self.exiftool_idle = queue.Queue()
+        with self.metadata_cache_lock:
+            if self.metadata_cache is not None:
+                self.metadata_cache.close()
+            self.metadata_cache = None
+
+    # Read the raw exiftool tags of one chunk of files with a pooled session
+    def readExifChunk(self, files: list) -> list:
+        et = self.acquireExifTool()
+        try:
+            with self.profileStage("exiftool"):
+                return et.get_tags(
+                    files,
+                    tags=[
+                        "Make",
+                        "Model",
+                        "ExifImageWidth",
+                        "ExifImageHeight",
+                        "RawImageFullWidth",
+                        "RawImageFullHeight",
+                        "ImageWidth",
+                        "ImageHeight",
+                        "ImageCount",
+                        "Iso",
+                        "FNumber",
+                        "ExposureTime",
+                        "FocalLength",
+                        "Orientation"
+                    ],
+                )
+        finally:
+            self.releaseExifTool(et)
 
     def readRawMetadata(self, files: list) -> dict:
+        if isinstance(files, str):
+            files = [files]
+        metadata = {}
+        cache = self.getMetadataCache()
+        if cache is not None:
+            metadata.update(cache.getMany(files))
+        missing_files = [file for file in files if file not in metadata]
+        debug("DEBUG", MetadataGenerator.readRawMetadata.__name__, ("METADATA CACHE HITS:", len(metadata), "MISSES:", len(missing_files)))
+        if not missing_files:
+            return metadata
+
+        # Files the native reader finds camera metadata in skip exiftool, the rest fall back to it
+        native_tags = []
+        exiftool_files = missing_files
+        if self.settings.getNativeExifReaderEnabled():
+            exiftool_files = []
+            for file in missing_files:
+                with self.profileStage("exif", file):
+                    tags = readExifTags(file)
+                if tags is not None and all(tags.get(tag) is not None for tag in NATIVE_REQUIRED_TAGS):
+                    native_tags.append(tags)
+                else:
+                    exiftool_files.append(file)
+            debug("DEBUG", MetadataGenerator.readRawMetadata.__name__, ("NATIVE EXIF READS:", len(native_tags), "EXIFTOOL:", len(exiftool_files)))
+
+        # Large selections are split into chunks, read in parallel when more than one session is allowed
+        chunk_size = max(1, self.exiftool_settings["Chunk_Size"])
+        chunks = [exiftool_files[i:i + chunk_size] for i in range(0, len(exiftool_files), chunk_size)]
+        sessions = min(self.exiftool_settings["Sessions"], len(chunks))
+        try:
+            if sessions > 1:
+                with ThreadPoolExecutor(max_workers=sessions) as executor:
+                    chunk_tags = list(executor.map(self.readExifChunk, chunks))
+            else:
+                chunk_tags = [self.readExifChunk(chunk) for chunk in chunks]
+        except (ImportError, OSError) as e:
+            # exiftool is not installed, keep what the native reader found
+            if not native_tags:
+                raise
+            debug("ERROR", MetadataGenerator.readRawMetadata.__name__, ("EXIFTOOL UNAVAILABLE", e))
+            chunk_tags = []
+        chunk_tags.append(native_tags)
+
         exif = {}
-        with ExifToolHelper() as et:
-            for d in et.get_tags(
-                files,
-                tags=[
-                    "Make",
-                    "Model",
-                    "ExifImageWidth",
-                    "ExifImageHeight",
-                    "RawImageFullWidth",
-                    "RawImageFullHeight",
-                    "ImageWidth",
-                    "ImageHeight",
-                    "ImageCount",
-                    "Iso",
-                    "FNumber",
-                    "ExposureTime",
-                    "FocalLength",
-                    "Orientation"
-                ],
-            ):
+        read_metadata = {}
+        for tags in chunk_tags:
+            for d in tags:
                 file = d.get("SourceFile")
                 exif[file] = {}
                 for k, v in d.items():
@@ -102,7 +457,6 @@ class MetadataGenerator:
                     # print(f"Dict: {key} = {v}")
                     exif[file][key] = v
 
-        metadata = {}
         for filename, data in exif.items():
             if data.get("Make", None) is None:
                 continue
@@ -128,79 +482,169 @@ class MetadataGenerator:
                     "FOCALLENGTH": round(data.get("FocalLength")),
                     "ORIENTATION": data.get("Orientation"),
                 }
+                read_metadata[filename] = metadata[filename]
+        if cache is not None:
+            cache.putMany(read_metadata)
         debug("DEBUG", MetadataGenerator.readRawMetadata.__name__, ("TRIMMED EXIF DATA:",metadata))
         return metadata
 
-    # Create a black placeholder image that will be added to the camera settings summary image as indicator of original image postion
-    def createPlaceholder(self, width: int, height: int) -> Image:
-        new_image = Image.new("RGBA", (width, height), color="black")
-        return new_image
-
     # Main function to create camera settings summary images
     def createCoverWithMetadata(
         self, width, height, metadata, image_placeholder, output_file=None
     ):
-        # Create a new blank TIFF image with the given width and height
-        # print(width, height)
-        # print(metadata)
-        new_image = Image.new("RGBA", (width, height), color="white")
+        new_image = self.composeCover(width, height, metadata, image_placeholder)
+        return self.saveCover(new_image, output_file)
+
+    # Draw the cover with camera settings footer and the placeholder at the top
+    # scale shrinks the footer, padding and fonts together for previews, covers are saved at scale 1
+    # image_placeholder None draws the black placeholder rectangle directly onto the cover
+    def composeCover(self, width, height, metadata, image_placeholder, scale: float = 1.0) -> Image:
+        padding_width = max(1, round(self.PADDING_WIDTH * scale))
+        # Create a new blank image with the given width and height
+        # Covers are fully opaque, so no alpha channel is kept
+        new_image = Image.new("RGB", (width, height), color="white")
+        footer = self.composeFooter(width, metadata, scale)
+        new_image.paste(footer, (0, height - footer.height))
+
+        # Image placeholder for the camera details cover
+        if image_placeholder is None:
+            new_image.paste((0, 0, 0), (padding_width, padding_width, width - padding_width, height - footer.height))
+        else:
+            new_image.paste(image_placeholder, (padding_width, padding_width))
+        return new_image
+
+    # Cover that is composited strip by strip while it is saved, see tiled_cover
+    # image_placeholder None stands for the black placeholder, which is never allocated and lets the PNG use a palette
+    def composeTiledCover(self, width, height, metadata, image_placeholder, scale: float = 1.0) -> TiledCover:
+        padding_width = max(1, round(self.PADDING_WIDTH * scale))
+        footer = self.composeFooter(width, metadata, scale)
+        if image_placeholder is None:
+            image_placeholder = SolidImage((width - padding_width * 2, height - padding_width - footer.height))
+        return TiledCover(width, height, image_placeholder, (padding_width, padding_width), footer)
+
+    # Whether a cover of this size is composited in strips, only PNG can be encoded that way
+    def useTiledCompositing(self, size: tuple) -> bool:
+        width, height = size
+        return (
+            self.tiled_settings["Enabled"]
+            and self.output_settings["Format"] == "png"
+            and width * height >= self.tiled_settings["Min_Megapixels"] * 1_000_000
+        )
+
+    # Footer with the model name, brand logo and camera details, as wide as the cover
+    # Covers sharing body, settings, width and fonts share one cached footer, it must not be drawn on
+    def composeFooter(self, width, metadata, scale: float = 1.0) -> Image:
+        brand = metadata.get("BRAND", None)
+        model = self.trimModelBrand(brand, metadata.get("MODEL", None))
+        camera_details = f"{metadata.get('FOCALLENGTH')}mm  ISO-{metadata.get('ISO')}  f/{metadata.get('FNUMBER')}  {metadata.get('EXPOSURE')}"
+        key = (
+            width,
+            scale,
+            brand,
+            model,
+            camera_details,
+            self.settings_dict.get("Title_Font_80", self.settings_dict["Default_Font"]),
+            self.settings_dict.get("Model_Font_80", self.settings_dict["Default_Font"]),
+            self.brand_logo_path,
+            self.FOOTER_HEIGHT,
+            self.PADDING_WIDTH,
+        )
+        return loadFooter(key, lambda: self.drawFooter(width, brand, model, camera_details, scale))
+
+    def drawFooter(self, width, brand, model, camera_details, scale: float = 1.0) -> Image:
+        def scaled(value):
+            return max(1, round(value * scale))
+
+        footer_height = scaled(self.FOOTER_HEIGHT)
+        new_image = Image.new("RGB", (width, footer_height), color="white")
         draw = ImageDraw.Draw(new_image)
-        font_40 = ImageFont.truetype(self.settings_dict.get("Font_40", self.settings_dict["Default_Font"]), size=40)
-        font_60 = ImageFont.truetype(self.settings_dict.get("Font_60", self.settings_dict["Default_Font"]), size=60)
-        title_font_80 = ImageFont.truetype(self.settings_dict.get("Title_Font_80", self.settings_dict["Default_Font"]), size=80)
-        model_font_80 = ImageFont.truetype(self.settings_dict.get("Model_Font_80", self.settings_dict["Default_Font"]), size=80)
+        title_font_path = self.settings_dict.get("Title_Font_80", self.settings_dict["Default_Font"])
+        title_font_80 = loadFont(title_font_path, scaled(80))
+        model_font_80 = loadFont(self.settings_dict.get("Model_Font_80", self.settings_dict["Default_Font"]), scaled(80))
+        padding_width = scaled(self.PADDING_WIDTH)
         # Draw metadata text onto the image
-        footer_x = self.PADDING_WIDTH
-        footer_y = height - self.FOOTER_HEIGHT
-        x = self.PADDING_WIDTH
-        y = height - self.FOOTER_HEIGHT + 10
-        brand = metadata.get("BRAND", None)
+        footer_x = padding_width
+        footer_y = 0
 
         # Model name section
-        model = self.trimModelBrand(brand, metadata.get("MODEL", None))
-        draw.text((footer_x, footer_y + 50), model, fill="black", font=model_font_80)
+        draw.text((footer_x, footer_y + scaled(50)), model, fill="black", font=model_font_80)
 
-        
         # Calculate camera details font size
-        camera_details = f"{metadata.get('FOCALLENGTH')}mm  ISO-{metadata.get('ISO')}  f/{metadata.get('FNUMBER')}  {metadata.get('EXPOSURE')}"
-        text_left, text_top, text_right, text_bottom = draw.textbbox(
-            (x, y), camera_details, font=title_font_80
-        )
-        text_width, text_height = (text_right - text_left, text_bottom - text_top)
-        debug("DEBUG", MetadataGenerator.createCoverWithMetadata.__name__, ("Text Size: ",text_width,text_height))
+        text_width, text_height = measureText(title_font_path, scaled(80), camera_details)
+        debug("DEBUG", MetadataGenerator.drawFooter.__name__, ("Text Size: ",text_width,text_height))
 
         if brand:
             # Brand logo section
-            brand_path = f"{self.brand_logo_path}/{brand}.png"
-            logo_image = Image.open(brand_path).convert("RGBA")
-            logo_image = ImageOps.contain(logo_image, (width, self.FOOTER_HEIGHT))
+            logo_image = loadScaledLogo(self.brand_logo_path, brand, (width, footer_height))
             logo_size = logo_image.size
-            debug("DEBUG", MetadataGenerator.createCoverWithMetadata.__name__, ("Brand Logo Size: ", logo_image.size))
+            debug("DEBUG", MetadataGenerator.drawFooter.__name__, ("Brand Logo Size: ", logo_image.size))
             brand_position, details_position = self.calculateBrandPosition(
-                width, text_width, logo_size[0]
+                width, text_width, logo_size[0], scale
             )
-            debug("DEBUG", MetadataGenerator.createCoverWithMetadata.__name__, ("Brand Position: ", brand_position, "Model Position: ", details_position))
+            debug("DEBUG", MetadataGenerator.drawFooter.__name__, ("Brand Position: ", brand_position, "Model Position: ", details_position))
             new_image.paste(logo_image, (brand_position, footer_y), mask=logo_image)
 
         # Camera details section
         draw.text(
-            (details_position, footer_y + 50), camera_details, fill="black", font=title_font_80
+            (details_position, footer_y + scaled(50)), camera_details, fill="black", font=title_font_80
         )
 
         # Seperator line for brand logo and camera details
         shape = [
-            (details_position - 28, footer_y + 30),
-            (details_position - 28, height - 30),
+            (details_position - scaled(28), footer_y + scaled(30)),
+            (details_position - scaled(28), footer_height - scaled(30)),
         ]
-        draw.line(shape, fill="#D3D3D3", width=10)
-
-        # Image placeholder for the camera details cover
-        new_image.paste(image_placeholder, (self.PADDING_WIDTH, self.PADDING_WIDTH))
+        draw.line(shape, fill="#D3D3D3", width=scaled(10))
+        return new_image
 
-        # Save the image as a PNG file
-        new_image.save(self.settings.getOutputPath() + output_file + ".png", format="png")
+    # Encode the cover with the format and compression from the output settings
+    # Tiled covers are streamed to PNG strip by strip, assembled first for any other format
+    # source_file is the image the cover was made from, it is never overwritten
+    def saveCover(self, new_image: Image, output_file: str, source_file: str = None) -> str:
+        output_settings = self.output_settings
+        output_format = output_settings["Format"]
+        output_path = self.settings.getOutputPath() + output_file + OUTPUT_FORMATS[output_format]
+        if source_file is not None and os.path.exists(output_path) and os.path.samefile(output_path, source_file):
+            # Output_Path is the folder of the source and the cover has its name and format
+            debug("ERROR", MetadataGenerator.saveCover.__name__, ("OUTPUT IS THE SOURCE FILE, ADDING SUFFIX", source_file))
+            output_path = self.settings.getOutputPath() + output_file + COVER_SUFFIX + OUTPUT_FORMATS[output_format]
+        if isinstance(new_image, TiledCover):
+            if output_format == "png":
+                new_image.savePng(output_path, output_settings["Compression_Level"], self.tiled_settings["Strip_Height"])
+                if self.show_images:
+                    Image.open(output_path).show()
+                return output_path
+            new_image = new_image.toImage()
+        if output_format == "jpeg":
+            if new_image.mode != "RGB":
+                new_image = new_image.convert("RGB")
+            # Pillow encodes JPEG with libjpeg-turbo when it was built with it
+            debug("DEBUG", MetadataGenerator.saveCover.__name__, ("LIBJPEG-TURBO:", features.check_feature("libjpeg_turbo")))
+            new_image.save(
+                output_path,
+                format="jpeg",
+                quality=output_settings["Quality"],
+                optimize=output_settings["Optimize"],
+                progressive=output_settings["Progressive"],
+            )
+        elif output_format == "webp":
+            new_image.save(
+                output_path,
+                format="webp",
+                quality=output_settings["Quality"],
+                method=output_settings["Method"],
+                lossless=output_settings["Lossless"],
+            )
+        else:
+            new_image.save(
+                output_path,
+                format="png",
+                compress_level=output_settings["Compression_Level"],
+                optimize=output_settings["Optimize"],
+            )
         if self.show_images:
             new_image.show()
+        return output_path
 
     # Trimmed out brand name from model name to avoid redundancy
     def trimModelBrand(self, brand: str, model: str) -> str:
@@ -209,10 +653,10 @@ class MetadataGenerator:
 
     # Calculate the brand logo position, and model name position based on image width
     def calculateBrandPosition(
-        self, image_width, model_width, logo_width
+        self, image_width, model_width, logo_width, scale: float = 1.0
     ) -> tuple[int, int]:
-        RIGHT_PADDING = self.PADDING_WIDTH
-        LOGO_TEXT_GAP = 60
+        RIGHT_PADDING = max(1, round(self.PADDING_WIDTH * scale))
+        LOGO_TEXT_GAP = max(1, round(60 * scale))
         logo_position = (
             image_width - RIGHT_PADDING - model_width - LOGO_TEXT_GAP - logo_width
         )
@@ -220,99 +664,628 @@ class MetadataGenerator:
         # print(image_width , RIGHT_PADDING , model_width , LOGO_TEXT_GAP , logo_width)
         return round(logo_position), round(model_position)
 
-    def readImage(self, file_path: str, size: tuple, settings: dict = {}):
+    # decode_quality overrides the RAW decode tier of the current job
+    # cancel_token is the token of the job the image is decoded for, prefetch and preview decodes pass none
+    def readImage(self, file_path: str, size: tuple, settings: dict = {}, decode_quality: str = None, cancel_token: CancellationToken = None):
+        decode_quality = decode_quality or self.decode_quality
+        bytes_read = 0
+        if self.profiler is not None and not self.hasDecodedImage(file_path, size, decode_quality):
+            bytes_read = os.path.getsize(file_path)
+        with self.profileStage("decode", file_path, bytes_read):
+            pil_image = self.decodeImage(file_path, size, decode_quality, settings.get("ORIENTATION"), cancel_token)
+        with self.profileStage("orient", file_path):
+            return self.orientImage(pil_image, settings)
+
+    # Decode an image file to the pixels as stored, resized so that they are size once turned upright
+    # size is the upright size from metadata, orientation the EXIF Orientation it was read with
+    # No rotation or mirroring is applied, orientImage does that in a single transpose
+    def decodeImage(self, file_path: str, size: tuple, decode_quality: str = "quality", orientation: int = None, cancel_token: CancellationToken = None) -> Image:
+        with self.decoded_images_lock:
+            pil_image = self.decoded_images.pop((file_path, tuple(size), decode_quality), None)
+        if pil_image is not None:
+            debug("DEBUG", MetadataGenerator.decodeImage.__name__, ("USING PREFETCHED IMAGE", file_path, size))
+            return pil_image
+        width, height = self.storedSize(size, orientation)
+        if os.path.splitext(file_path)[1].lower() in RAW_EXTENSIONS:
+            return self.readRawImage(file_path, (width, height), decode_quality, cancel_token)
         try:
-            width, height = size
-            raw_image = imread(file_path)
-            resized_image = resize(raw_image, (height, width), preserve_range=True, anti_aliasing=True)
-            pil_image = Image.fromarray(resized_image.astype('uint8'))
+            return self.readStandardImage(file_path, (width, height))
         except OSError as err:
-            debug("ERROR",MetadataGenerator.readImage.__name__, "USING ALTERNATIVE RAWPY TO READ IMAGE")
-            # Load the RAW file
-            with rawpy.imread(file_path) as raw:
-                # Convert the RAW data to an RGB image
-                rgb = raw.postprocess(
-                    use_camera_wb=True,
-                    demosaic_algorithm=rawpy.DemosaicAlgorithm.AAHD,
-                    output_color=rawpy.ColorSpace.sRGB,
-                    median_filter_passes=2,
-                    no_auto_bright=True, 
-                )        
-            # Create a PIL Image object from the RGB data
-            pil_image = Image.fromarray(rgb.astype("uint8"))
-            pil_image = pil_image.resize((width, height))
-
-        if settings.get("MIRROR", False):
-            # print("MIRRORED")
-            pil_image = ImageOps.mirror(pil_image)
-        # print(settings.get("ROTATION", 0))
-        rotation = min(int(settings.get("ROTATION", 0)),360)
-        pil_image = pil_image.rotate(rotation, resample=Image.NEAREST, expand=True)
-        # print(pil_image.size)
-        # if abs(rotation) in [90, 270]:
-        #     pil_image = pil_image.transpose(Image.TRANSPOSE)
-        # print(pil_image.size)
-
-
-        # pil_image.show()
+            debug("ERROR",MetadataGenerator.decodeImage.__name__, "USING ALTERNATIVE RAWPY TO READ IMAGE")
+            return self.readRawImage(file_path, (width, height), decode_quality, cancel_token)
+
+    # Size of the stored pixels for an upright size, swapped for EXIF orientations that turn the image sideways
+    def storedSize(self, size: tuple, orientation: int = None) -> tuple:
+        width, height = size
+        if orientation in [5, 6, 7, 8]:
+            return (height, width)
+        return (width, height)
+
+    # Split a ROTATION setting in degrees into counter-clockwise quarter turns and the remaining angle
+    def splitRotation(self, rotation) -> tuple:
+        rotation = float(rotation or 0) % 360
+        return int(rotation // 90), rotation % 90
+
+    # Single transpose for EXIF Orientation, then MIRROR, then the quarter turns of ROTATION, or None
+    def orientationTranspose(self, settings: dict = {}):
+        quarter_turns, _ = self.splitRotation(settings.get("ROTATION", 0))
+        transposes = [
+            EXIF_ORIENTATION_TRANSPOSES.get(settings.get("ORIENTATION")),
+            Image.FLIP_LEFT_RIGHT if settings.get("MIRROR", False) else None,
+            QUARTER_TURN_TRANSPOSES[quarter_turns],
+        ]
+        matrix = TRANSPOSE_MATRICES[None]
+        for transpose in transposes:
+            (a, b), (c, d) = TRANSPOSE_MATRICES[transpose]
+            (e, f), (g, h) = matrix
+            matrix = ((a * e + b * g, a * f + b * h), (c * e + d * g, c * f + d * h))
+        return next(transpose for transpose, transpose_matrix in TRANSPOSE_MATRICES.items() if transpose_matrix == matrix)
+
+    # Turn pixels from decodeImage into the cover orientation with one lossless transpose
+    # An angle left over after the quarter turns is rotated and fitted back into the same box,
+    # so the image always matches the image area from coverSize
+    def orientImage(self, pil_image: Image, settings: dict = {}) -> Image:
+        transpose = self.orientationTranspose(settings)
+        if transpose is not None:
+            pil_image = pil_image.transpose(transpose)
+        _, residual = self.splitRotation(settings.get("ROTATION", 0))
+        if residual:
+            box = pil_image.size
+            pil_image = pil_image.rotate(residual, resample=Image.BICUBIC, expand=True, fillcolor="white")
+            pil_image = ImageOps.pad(pil_image, box, color="white")
         return pil_image
 
-    # Generate camera settings summary image based on metadata given
-    def generateCover(self, metadata: dict, combine_original_images: bool = False) -> None:
-        progress = int(89 / len(metadata))
-        for file, data in metadata.items():
-            filename = ".".join(file.split("/")[-1].split(".")[:-1])
-            width = data.get("WIDTH")
-            height = data.get("HEIGHT")
-
-            if data.get("ROTATION") in ["90", "270"]:
-                width, height = height, width
-
-            image_width = width + self.PADDING_WIDTH * 2
-            image_height = height + self.PADDING_WIDTH + self.FOOTER_HEIGHT
-            
-            
-            image_placeholder = None
-            if not combine_original_images:
-                image_placeholder = self.createPlaceholder(
-                    width, height
-                )
+    # Settings orientImage needs from the metadata of a file
+    def orientationSettings(self, data: dict) -> dict:
+        return {
+            "ORIENTATION": data.get("ORIENTATION"),
+            "ROTATION": data.get("ROTATION", 0),
+            "MIRROR": data.get("MIRROR", False),
+        }
+
+    # Decode a regular image file with Pillow straight to the target size, keeping 8-bit pixels throughout
+    # JPEG files are decoded at the smallest DCT scale (1/2, 1/4, 1/8) that still covers the target size,
+    # other formats are shrunk by whole factors with reduce() before the final Lanczos pass
+    # Peak memory is the decoded source at 8 bits per channel plus the target image,
+    # e.g. about 300 MB + 300 MB for a 100 MP RGB TIFF rendered at full size
+    def readStandardImage(self, file_path: str, size: tuple) -> Image:
+        width, height = size
+        with Image.open(file_path) as source:
+            source.draft("RGB", (width, height))
+            if source.mode.startswith("I;16") or source.mode == "I":
+                # 16-bit greyscale, keep the top 8 bits
+                source = source.convert("I").point(lambda value: value * (1 / 256)).convert("L")
+            elif source.mode not in ["RGB", "RGBA", "L"]:
+                has_alpha = source.mode in ["LA", "PA"] or "transparency" in source.info
+                source = source.convert("RGBA" if has_alpha else "RGB")
+            if source.size == (width, height):
+                # Already at the target size, keep the decoded pixels instead of resampling into a copy
+                source.load()
+                return source
+            pil_image = source.resize((width, height), resample=Image.LANCZOS, reducing_gap=3.0)
+        return pil_image
+
+    # Decode a RAW file with rawpy, doing only as much work as the decode tier and target size need
+    # draft: embedded JPEG preview, else half size linear demosaic
+    # balanced: embedded preview if it covers the target size, else half size or AHD demosaic
+    # quality: full size AAHD demosaic with median filtering
+    def readRawImage(self, file_path: str, size: tuple, decode_quality: str = "quality", cancel_token: CancellationToken = None) -> Image:
+        # rawpy pulls in numpy and LibRaw, only load it once a RAW file is decoded
+        import rawpy
+
+        width, height = size
+        with rawpy.imread(file_path) as raw:
+            if decode_quality in ["draft", "balanced"]:
+                thumb_image = self.readRawThumbnail(raw)
+                if thumb_image is not None and (
+                    decode_quality == "draft" or thumb_image.width * thumb_image.height >= width * height
+                ):
+                    debug("DEBUG", MetadataGenerator.readRawImage.__name__, ("USING EMBEDDED PREVIEW", thumb_image.size))
+                    return thumb_image.resize((width, height))
+
+            # Demosaicing cannot be interrupted, give up before starting it if the job was cancelled
+            if cancel_token is not None:
+                cancel_token.checkpoint()
+
+            # Half size skips demosaicing and still covers the target when the sensor is twice as large
+            sensor_width, sensor_height = raw.sizes.width, raw.sizes.height
+            half_size = decode_quality == "draft" or (sensor_width >= width * 2 and sensor_height >= height * 2)
+            if decode_quality == "quality":
+                half_size = False
+                demosaic_algorithm = rawpy.DemosaicAlgorithm.AAHD
+                median_filter_passes = 2
+            elif decode_quality == "balanced":
+                demosaic_algorithm = rawpy.DemosaicAlgorithm.AHD
+                median_filter_passes = 0
             else:
-                image_placeholder = self.readImage(file, (data.get("WIDTH"), data.get("HEIGHT")), { "ROTATION":data.get("ROTATION", 0), "MIRROR": data.get("MIRROR", False)})
+                demosaic_algorithm = rawpy.DemosaicAlgorithm.LINEAR
+                median_filter_passes = 0
+            debug("DEBUG", MetadataGenerator.readRawImage.__name__, ("RAW DECODE", decode_quality, "HALF SIZE:", half_size))
+            # Convert the RAW data to an RGB image, left unrotated like every other decoder
+            rgb = raw.postprocess(
+                user_flip=0,
+                use_camera_wb=True,
+                demosaic_algorithm=demosaic_algorithm,
+                output_color=rawpy.ColorSpace.sRGB,
+                median_filter_passes=median_filter_passes,
+                half_size=half_size,
+                no_auto_bright=True,
+            )
+        # Create a PIL Image object from the RGB data
+        pil_image = Image.fromarray(rgb.astype("uint8"))
+        return pil_image.resize((width, height))
+
+    # Embedded JPEG preview of a RAW file as stored, unrotated, or None
+    def readRawThumbnail(self, raw) -> Image:
+        import rawpy
+
+        try:
+            thumb = raw.extract_thumb()
+        except (rawpy.LibRawNoThumbnailError, rawpy.LibRawUnsupportedThumbnailError):
+            return None
+        if thumb.format == rawpy.ThumbFormat.JPEG:
+            thumb_image = Image.open(io.BytesIO(thumb.data))
+            thumb_image.draft("RGB", thumb_image.size)
+            thumb_image = thumb_image.convert("RGB")
+        elif thumb.format == rawpy.ThumbFormat.BITMAP:
+            thumb_image = Image.fromarray(thumb.data)
+        else:
+            return None
+        return thumb_image
+
+    # Keep a decoded image for a later decodeImage call with the same file, size and decode tier
+    def storeDecodedImage(self, file_path: str, size: tuple, decode_quality: str, pil_image: Image) -> None:
+        key = (file_path, tuple(size), decode_quality)
+        with self.decoded_images_lock:
+            self.decoded_images[key] = pil_image
+            self.decoded_images.move_to_end(key)
+            while len(self.decoded_images) > self.max_decoded_images:
+                self.decoded_images.popitem(last=False)
+
+    def hasDecodedImage(self, file_path: str, size: tuple, decode_quality: str) -> bool:
+        with self.decoded_images_lock:
+            return (file_path, tuple(size), decode_quality) in self.decoded_images
+
+    # Size to decode a file at for a preview whose longest side is max_side
+    def previewSourceSize(self, data: dict, max_side: int) -> tuple:
+        width, height = data.get("WIDTH"), data.get("HEIGHT")
+        scale = min(max_side / width, max_side / height, 1.0)
+        return (max(1, round(width * scale)), max(1, round(height * scale)))
+
+    # Load the fonts and scaled brand logo the cover footer will need
+    def warmResources(self, data: dict, image_width: int) -> None:
+        loadFont(self.settings_dict.get("Title_Font_80", self.settings_dict["Default_Font"]), 80)
+        loadFont(self.settings_dict.get("Model_Font_80", self.settings_dict["Default_Font"]), 80)
+        if data.get("BRAND"):
+            loadScaledLogo(self.brand_logo_path, data.get("BRAND"), (image_width, self.FOOTER_HEIGHT))
+
+    # Prepare a file ahead of generation: metadata into the cache, footer resources loaded,
+    # and when combining, the image decoded at cover size and optionally at preview size
+    # cancelled is polled between steps so a removed file stops as soon as possible
+    def prefetchFile(self, file: str, combine_original_images: bool = False, decode_quality: str = None, preview_side: int = None, cancelled=lambda: False) -> None:
+        data = self.readFileMetadata(file)
+        if data is None or cancelled():
+            return
+        (image_width, image_height), _ = self.coverSize(data)
+        self.warmResources(data, image_width)
+        decode_quality = decode_quality or self.decode_quality
+        # Process pool workers decode on their own, images decoded here would never be used
+        if combine_original_images and self.workers <= 1 and not cancelled():
+            size = (data.get("WIDTH"), data.get("HEIGHT"))
+            if not self.hasDecodedImage(file, size, decode_quality):
+                self.storeDecodedImage(file, size, decode_quality, self.decodeImage(file, size, decode_quality, data.get("ORIENTATION")))
+        if preview_side and not cancelled():
+            size = self.previewSourceSize(data, preview_side)
+            if not self.hasDecodedImage(file, size, "draft"):
+                self.storeDecodedImage(file, size, "draft", self.decodeImage(file, size, "draft", data.get("ORIENTATION")))
+
+    # Size of the cover and of the image area inside it for the given metadata
+    def coverSize(self, data: dict) -> tuple:
+        width = data.get("WIDTH")
+        height = data.get("HEIGHT")
+
+        quarter_turns, _ = self.splitRotation(data.get("ROTATION", 0))
+        if quarter_turns in [1, 3]:
+            width, height = height, width
+
+        image_width = width + self.PADDING_WIDTH * 2
+        image_height = height + self.PADDING_WIDTH + self.FOOTER_HEIGHT
+        return (image_width, image_height), (width, height)
+
+    # Render the cover at reduced resolution so it fits in max_size, nothing is saved
+    # source is an image of the file from decodeImage at any size, used instead of decoding again
+    def renderPreview(self, file: str, data: dict, max_size: tuple, combine_original_images: bool = False, source: Image = None) -> Image:
+        (image_width, image_height), (width, height) = self.coverSize(data)
+        scale = min(max_size[0] / image_width, max_size[1] / image_height, 1.0)
+        padding_width = max(1, round(self.PADDING_WIDTH * scale))
+        footer_height = max(1, round(self.FOOTER_HEIGHT * scale))
+        preview_width = max(1, round(width * scale))
+        preview_height = max(1, round(height * scale))
+        if not combine_original_images:
+            image_placeholder = None
+        else:
+            # Decode at the preview size, then orient the small image
+            decode_size = (max(1, round(data.get("WIDTH") * scale)), max(1, round(data.get("HEIGHT") * scale)))
+            if source is None:
+                source = self.decodeImage(file, decode_size, "draft", data.get("ORIENTATION"))
+            elif source.size != self.storedSize(decode_size, data.get("ORIENTATION")):
+                source = source.resize(self.storedSize(decode_size, data.get("ORIENTATION")))
+            image_placeholder = self.orientImage(source, self.orientationSettings(data))
+        return self.composeCover(
+            preview_width + padding_width * 2,
+            preview_height + padding_width + footer_height,
+            data,
+            image_placeholder,
+            scale,
+        )
+
+    # Pipeline stages, each takes a job item dict for one file and returns it with its stage output added
+    # Items read ahead by iterReadAhead already carry their metadata
+    def metadataStage(self, item: dict, metadata: dict = None) -> dict:
+        if "data" not in item:
+            with self.profileStage("metadata", item["file"]):
+                item["data"] = self.readFileMetadata(item["file"], metadata)
+        if item["data"] is None:
+            raise ValueError("No camera metadata found")
+        return item
+
+    # Mark the item as skipped when the output manifest already has a current cover for it
+    def outputCheckStage(self, item: dict, combine_original_images: bool = False) -> dict:
+        manifest = self.getOutputManifest()
+        if manifest is None:
+            return item
+        item["digest"] = OutputManifest.digest(item["file"], item["data"], self.renderSettings(combine_original_images))
+        output = None if self.force else manifest.currentOutput(item["file"], item["digest"])
+        if output is not None:
+            debug("DEBUG", MetadataGenerator.outputCheckStage.__name__, ("UNCHANGED, SKIPPED", item["file"]))
+            item["skipped"] = True
+            item["output"] = output
+        return item
 
-            self.createCoverWithMetadata(
-                image_width, image_height, data, image_placeholder, filename
+    def decodeStage(self, item: dict, combine_original_images: bool = False) -> dict:
+        if item.get("skipped"):
+            return item
+        file = item["file"]
+        data = item["data"]
+        item["size"], (width, height) = self.coverSize(data)
+
+        if not combine_original_images:
+            # The placeholder is drawn straight onto the cover, nothing to decode or allocate
+            item["placeholder"] = None
+        else:
+            item["placeholder"] = self.readImage(
+                file, (data.get("WIDTH"), data.get("HEIGHT")), self.orientationSettings(data), cancel_token=self.cancel_token
+            )
+        return item
+
+    def composeStage(self, item: dict) -> dict:
+        if item.get("skipped"):
+            return item
+        image_width, image_height = item["size"]
+        compose = self.composeCover
+        if self.useTiledCompositing(item["size"]) or (item["placeholder"] is None and self.output_settings["Format"] == "png"):
+            compose = self.composeTiledCover
+        with self.profileStage("compose", item["file"]):
+            item["image"] = compose(image_width, image_height, item["data"], item.pop("placeholder"))
+        return item
+
+    def saveStage(self, item: dict) -> dict:
+        if item.get("skipped"):
+            return item
+        filename = ".".join(item["file"].split("/")[-1].split(".")[:-1])
+        with self.profileStage("save", item["file"]) as record:
+            item["output"] = self.saveCover(item.pop("image"), filename, item["file"])
+            if record is not None:
+                record["bytes_written"] = os.path.getsize(item["output"])
+        self.recordOutput(item["file"], item.get("digest"), item["output"])
+        return item
+
+    # Everything besides the file and its metadata that changes how a cover looks
+    def renderSettings(self, combine_original_images: bool = False) -> dict:
+        return {
+            "combine_original_images": combine_original_images,
+            "decode_quality": self.decode_quality if combine_original_images else None,
+            "output": self.output_settings,
+            "fonts": self.settings_dict,
+            "brand_logo_path": self.brand_logo_path,
+            "layout": [self.FOOTER_HEIGHT, self.PADDING_WIDTH],
+        }
+
+    # Time the enclosed block as one stage of the running job, does nothing unless the job is profiled
+    def profileStage(self, name: str, file: str = None, bytes_read: int = 0):
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.stage(name, file, bytes_read)
+
+    # Start profiling a job when enabled in settings, cProfile only runs when it has somewhere to write to
+    def startProfiling(self) -> None:
+        profiling_settings = self.settings.getProfilingSettings()
+        if not profiling_settings["Enabled"]:
+            return
+        self.profiler = JobProfiler(cprofile=bool(profiling_settings["CProfile_Path"]))
+        self.profiler.startCProfile()
+
+    # Stop profiling and write the report, trace and cProfile stats that have a path in settings
+    def finishProfiling(self) -> dict:
+        profiler = self.profiler
+        if profiler is None:
+            return None
+        self.profiler = None
+        profiling_settings = self.settings.getProfilingSettings()
+        profiler.finish()
+        try:
+            profiler.stopCProfile(profiling_settings["CProfile_Path"])
+            if profiling_settings["Report_Path"]:
+                profiler.exportJson(profiling_settings["Report_Path"])
+            if profiling_settings["Trace_Path"]:
+                profiler.exportChromeTrace(profiling_settings["Trace_Path"])
+        except OSError as e:
+            debug("ERROR", MetadataGenerator.finishProfiling.__name__, e)
+        summary = profiler.summary()
+        debug("DEBUG", MetadataGenerator.finishProfiling.__name__, summary["stages"])
+        return summary
+
+    # Output manifest of the current output directory, or None when disabled
+    def getOutputManifest(self):
+        if not self.settings.getOutputManifestEnabled():
+            return None
+        manifest_path = self.settings.getOutputPath() + ".cover_manifest.json"
+        with self.output_manifests_lock:
+            if manifest_path not in self.output_manifests:
+                self.output_manifests[manifest_path] = OutputManifest(manifest_path)
+            return self.output_manifests[manifest_path]
+
+    def recordOutput(self, file: str, digest: str, output: str) -> None:
+        manifest = self.getOutputManifest()
+        if manifest is not None and digest is not None:
+            manifest.record(file, digest, output)
+            try:
+                manifest.saveIfDue()
+            except OSError as e:
+                debug("ERROR", MetadataGenerator.recordOutput.__name__, (manifest.manifest_path, e))
+
+    def saveOutputManifests(self) -> None:
+        with self.output_manifests_lock:
+            manifests = list(self.output_manifests.values())
+        for manifest in manifests:
+            try:
+                manifest.save()
+            except OSError as e:
+                debug("ERROR", MetadataGenerator.saveOutputManifests.__name__, (manifest.manifest_path, e))
+
+    # Render a single cover and report the output path or the error raised while rendering it
+    def renderFile(self, file: str, data: dict, combine_original_images: bool = False) -> dict:
+        result = {"file": file, "output": None, "error": None}
+        try:
+            item = {"file": file, "data": data}
+            item = self.decodeStage(item, combine_original_images)
+            item = self.composeStage(item)
+            item = self.saveStage(item)
+            result["output"] = item["output"]
+        except Exception as e:
+            debug("ERROR", MetadataGenerator.renderFile.__name__, (file, e))
+            result["error"] = f"{type(e).__name__}: {e}"
+        return result
+
+    # Metadata for a single file, taken from the given metadata when present, otherwise read from the file
+    def readFileMetadata(self, file: str, metadata: dict = None) -> dict:
+        if metadata is not None and file in metadata:
+            return metadata[file]
+        return self.readRawMetadata([file]).get(file)
+
+    # Job items of files with their metadata, read ahead in windows of Chunk_Size files with one readRawMetadata call
+    # each, so a batch costs one exiftool call per window instead of one per file
+    # Files given in metadata are taken as they are, files of a window that failed to read are left to metadataStage
+    def iterReadAhead(self, files: list, metadata: dict = None):
+        chunk_size = max(1, self.exiftool_settings["Chunk_Size"])
+        for start in range(0, len(files), chunk_size):
+            window = files[start:start + chunk_size]
+            missing_files = [file for file in window if metadata is None or file not in metadata]
+            read_metadata = {}
+            window_failed = False
+            if missing_files:
+                try:
+                    with self.profileStage("metadata"):
+                        read_metadata = self.readRawMetadata(missing_files)
+                except Exception as e:
+                    debug("ERROR", MetadataGenerator.iterReadAhead.__name__, e)
+                    window_failed = True
+            for file in window:
+                if metadata is not None and file in metadata:
+                    yield {"file": file, "data": metadata[file]}
+                elif window_failed:
+                    yield {"file": file}
+                else:
+                    yield {"file": file, "data": read_metadata.get(file)}
+
+    # Generate covers file by file, yielding each result as soon as it is ready and in the order of files
+    # In-process generation overlaps the metadata, decode, compose and save stages of consecutive files,
+    # and no more than max_in_flight images are held at once
+    # Results are dicts of file, output path and error message
+    def iterGenerate(self, files: list, combine_original_images: bool = False, metadata: dict = None, max_in_flight: int = None):
+        if self.workers > 1 and len(files) > 1:
+            yield from self.iterGenerateParallel(files, combine_original_images, metadata, max_in_flight)
+            return
+        pipeline_settings = self.settings.getPipelineSettings()
+        pipeline = StagedPipeline(
+            [
+                ("metadata", lambda item: self.outputCheckStage(self.metadataStage(item, metadata), combine_original_images), pipeline_settings["Metadata"]),
+                ("decode", lambda item: self.decodeStage(item, combine_original_images), pipeline_settings["Decode"]),
+                ("compose", self.composeStage, pipeline_settings["Compose"]),
+                ("save", self.saveStage, pipeline_settings["Save"]),
+            ],
+            max_in_flight or pipeline_settings["Max_In_Flight"],
+        )
+        # cProfile only sees the thread it was enabled on, so profiled jobs run their stages inline
+        run = pipeline.run
+        if self.profiler is not None and self.profiler.profile is not None:
+            run = pipeline.runInline
+        try:
+            for item, error in run(self.iterReadAhead(files, metadata), self.cancel_token):
+                if isinstance(error, JobCancelled):
+                    continue
+                if error is not None:
+                    debug("ERROR", MetadataGenerator.iterGenerate.__name__, (item["file"], error))
+                    yield {"file": item["file"], "output": None, "error": f"{type(error).__name__}: {error}"}
+                elif item.get("skipped"):
+                    yield {"file": item["file"], "output": item["output"], "error": None, "skipped": True}
+                else:
+                    yield {"file": item["file"], "output": item["output"], "error": None}
+        finally:
+            self.saveOutputManifests()
+
+    # Spread the per-file work over a process pool while keeping a bounded window of files in flight
+    def iterGenerateParallel(self, files: list, combine_original_images: bool = False, metadata: dict = None, max_in_flight: int = None):
+        from concurrent.futures import ProcessPoolExecutor
+
+        workers = min(self.workers, len(files))
+        max_in_flight = max_in_flight or workers * 2
+        pending = deque()
+        # A pool kept by startProcessPool is reused, otherwise one is started for this job only
+        executor = self.process_pool
+        if executor is None:
+            executor = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_initCoverWorker,
+                initargs=(self.brand_logo_path, self.settings),
             )
-            if self.connected_progress_bar:
-                value = self.progress_bar.value() + progress
-                # print("VALUE ", value)
-                self.updateProgressBar(value)
+        with nullcontext(executor) if executor is self.process_pool else executor:
+            try:
+                for item in self.iterReadAhead(files, metadata):
+                    file = item["file"]
+                    while len(pending) >= max_in_flight:
+                        yield self.collectParallelResult(*pending.popleft())
+                    try:
+                        self.checkpoint()
+                    except JobCancelled:
+                        # Files not yet picked up by a worker are dropped, running ones are allowed to finish
+                        for _, future, _ in pending:
+                            if future is not None:
+                                future.cancel()
+                        break
+                    try:
+                        item = self.outputCheckStage(self.metadataStage(item, metadata), combine_original_images)
+                    except Exception as e:
+                        debug("ERROR", MetadataGenerator.iterGenerateParallel.__name__, (file, e))
+                        pending.append((file, None, {"file": file, "output": None, "error": f"{type(e).__name__}: {e}"}))
+                        continue
+                    if item.get("skipped"):
+                        pending.append((file, None, {"file": file, "output": item["output"], "error": None, "skipped": True}))
+                        continue
+                    future = executor.submit(_renderCoverTask, file, item["data"], combine_original_images, self.decode_quality, self.profiler is not None)
+                    pending.append((file, future, item.get("digest")))
+                while pending:
+                    result = self.collectParallelResult(*pending.popleft())
+                    if result is not None:
+                        yield result
+            finally:
+                self.saveOutputManifests()
+
+    # Result of a submitted file, or None when it was cancelled before a worker picked it up
+    # Entries without a future carry their result already, the others carry the output manifest digest
+    def collectParallelResult(self, file: str, future, result_or_digest) -> dict:
+        if future is None:
+            return result_or_digest
+        if future.cancelled():
+            return None
+        try:
+            result = future.result()
+        except Exception as e:
+            # Worker process died before it could report back
+            debug("ERROR", MetadataGenerator.collectParallelResult.__name__, (file, e))
+            return {"file": file, "output": None, "error": f"{type(e).__name__}: {e}"}
+        timings = result.pop("timings", None)
+        if timings and self.profiler is not None:
+            self.profiler.merge(timings)
+        if result["output"]:
+            self.recordOutput(file, result_or_digest, result["output"])
+            if self.show_images:
+                Image.open(result["output"]).show()
+        return result
+
+    # Generate camera settings summary image based on metadata given
+    # Results are returned in the same order as metadata, one entry per file
+    def generateCover(self, metadata: dict, combine_original_images: bool = False) -> list:
+        files = list(metadata.keys())
+        return self.collectResults(self.iterGenerate(files, combine_original_images, metadata), files)
+
+    # Drain a result iterator, advancing the progress bar from 5% to 94% as files finish
+    # job_report records completed outputs, failures and the files a cancelled job did not get to
+    def collectResults(self, results_iterator, files: list) -> list:
+        results = []
+        self.job_report = {"completed": {}, "failed": {}, "remaining": [], "cancelled": False}
+        for result in results_iterator:
+            results.append(result)
+            if result["error"] is None:
+                self.job_report["completed"][result["file"]] = result["output"]
+            else:
+                self.job_report["failed"][result["file"]] = result["error"]
+            self.updateProgressBar(5 + int(89 * len(results) / max(len(files), 1)))
+        finished = set(self.job_report["completed"]) | set(self.job_report["failed"])
+        self.job_report["remaining"] = [file for file in files if file not in finished]
+        self.job_report["cancelled"] = self.cancel_token is not None and self.cancel_token.isCancelled()
+        return results
+
+    # Block while the current job is paused, raise JobCancelled once it is cancelled
+    # Only for the thread running the job, decodes get the job's token passed in instead
+    def checkpoint(self) -> None:
+        if self.cancel_token is not None:
+            self.cancel_token.checkpoint()
 
     # Run the generator based on given files and generator corresponding camera settings summary
-    def exec(self, files: list, show_images: bool = True, combine_original_images: bool = False) -> None:
+    # decode_quality picks the RAW decode tier for this job, None uses the tier from settings
+    # cancel_token lets another thread pause, resume or cancel the job between files and stages
+    # skip_files are left out, e.g. the completed files of an earlier cancelled run
+    # force regenerates covers the output manifest reports as unchanged
+    def exec(self, files: list, show_images: bool = True, combine_original_images: bool = False, decode_quality: str = None, cancel_token: CancellationToken = None, skip_files: list = None, force: bool = False) -> list:
         self.show_images = show_images
+        self.force = force
+        self.decode_quality = decode_quality or self.settings.getDecodeQuality()
+        self.cancel_token = cancel_token
+        if isinstance(files, str):
+            files = [files]
+        if skip_files:
+            skip_files = set(skip_files)
+            files = [file for file in files if file not in skip_files]
         self.updateProgressBar(0)
-        exif = self.readRawMetadata(files)
-        self.updateProgressBar(5)
-        # print(exif)
-        if len(exif) != 0:
-            self.generateCover(exif, combine_original_images)
+        self.startProfiling()
+        try:
+            results = self.collectResults(self.iterGenerate(files, combine_original_images), files)
+        finally:
+            self.finishProfiling()
+            self.cancel_token = None
+            self.force = False
         self.updateProgressBar(100)
         self.disconnectProgressCallback()
+        return results
 
-    def execSettings(self, exif: dict, show_images: bool = True, combine_original_images: bool = False) -> None:
+    def execSettings(self, exif: dict, show_images: bool = True, combine_original_images: bool = False, decode_quality: str = None, cancel_token: CancellationToken = None, force: bool = False) -> list:
         self.show_images = show_images
+        self.force = force
+        self.decode_quality = decode_quality or self.settings.getDecodeQuality()
+        self.cancel_token = cancel_token
         self.updateProgressBar(0)
-        if len(exif) != 0:
-            self.generateCover(exif, combine_original_images)
+        self.startProfiling()
+        results = []
+        try:
+            if len(exif) != 0:
+                results = self.generateCover(exif, combine_original_images)
+        finally:
+            self.finishProfiling()
+            self.cancel_token = None
+            self.force = False
         self.updateProgressBar(100)
         self.disconnectProgressCallback()
+        return results
 
     def updateProgressBar(self, value: int) -> None:
         value = min(value, 100)
         if self.connected_progress_callback:
             self.progress_callback.emit(value)
         elif self.connected_progress_bar:
+            # Qt is only loaded when a progress bar is connected, scripted use never imports it
+            from PyQt5.QtWidgets import QApplication
+
             self.progress_bar.setValue(value)
             QApplication.processEvents()
 
@@ -327,7 +1300,7 @@ class MetadataGenerator:
             self.progress_callback = None
             self.connected_progress_callback = False
 
-    def connectToProgressBar(self, progress_bar: QProgressBar) -> None:
+    def connectToProgressBar(self, progress_bar: "QProgressBar") -> None:
         self.progress_bar = progress_bar
         self.connected_progress_bar = True
 
@@ -336,6 +1309,33 @@ class MetadataGenerator:
         self.connected_progress_bar = False
 
 
+# Generator owned by each parallel worker process, created once per process by the pool initializer
+_worker_generator = None
+
+def _initCoverWorker(brand_logo_path, settings: AppSettings) -> None:
+    global _worker_generator
+    # Ctrl+C reaches the whole process group, the parent stops the pool instead
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_generator = MetadataGenerator(brand_logo_path, settings)
+    _worker_generator.show_images = False
+
+def _warmUpCoverWorker() -> None:
+    _worker_generator.loadResources()
+
+# Profiled jobs send the stage timings of each file back with its result, merged by collectParallelResult
+def _renderCoverTask(file: str, data: dict, combine_original_images: bool, decode_quality: str, profile: bool = False) -> dict:
+    _worker_generator.decode_quality = decode_quality
+    if not profile:
+        return _worker_generator.renderFile(file, data, combine_original_images)
+    _worker_generator.profiler = JobProfiler()
+    try:
+        result = _worker_generator.renderFile(file, data, combine_original_images)
+        result["timings"] = _worker_generator.profiler.records
+    finally:
+        _worker_generator.profiler = None
+    return result
+
+
 if __name__ == "__main__":
     # "J:/2024_03/20240319/JPG/IMG20240319154927.jpg", "J:/2024_03/20240328/RAW/DSCF0067.RAF","J:/2024_03/20240319/RAW/IMG_1515.CR2","J:/2024_03/20240331/DSCF0080.RAF"
     # "J:/2024_03/20240319/RAW/IMG_1515.CR2"
@@ -346,4 +1346,5 @@ if __name__ == "__main__":
     gen = MetadataGenerator(BRAND_LOGO_PATH, settings)
     # gen.read_raw_metadata(files)
     gen.exec(files, True, True)
+    gen.close()
     # gen.read_image(files[0], (3648, 2736))
@@ -0,0 +1,154 @@
+import mmap
+import os
+import struct
+
+# In-process EXIF reader for JPEG, TIFF and TIFF based RAW files such as CR2
+# Only the header bytes holding the IFDs are touched, the file is memory-mapped so image data is never read
+# Tags are returned with the names and numeric values exiftool reports, so both go through the same normalization
+
+NATIVE_EXIF_EXTENSIONS = [".jpg", ".jpeg", ".tif", ".tiff", ".cr2"]
+
+# IFD0 tags
+IFD0_TAGS = {
+    0x010F: "Make",
+    0x0110: "Model",
+    0x0112: "Orientation",
+    0x0100: "ImageWidth",
+    0x0101: "ImageHeight",
+}
+
+# Exif IFD tags
+EXIF_IFD_TAGS = {
+    0x829A: "ExposureTime",
+    0x829D: "FNumber",
+    0x8827: "ISO",
+    0x920A: "FocalLength",
+    0xA002: "ExifImageWidth",
+    0xA003: "ExifImageHeight",
+}
+
+EXIF_IFD_POINTER = 0x8769
+
+# TIFF field types: struct format and size of one value
+FIELD_TYPES = {
+    1: ("B", 1),
+    2: ("s", 1),
+    3: ("H", 2),
+    4: ("I", 4),
+    5: ("II", 8),
+    7: ("B", 1),
+    9: ("i", 4),
+    10: ("ii", 8),
+}
+
+# JPEG start of frame markers, every SOFn except DHT, JPG and DAC
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+# Tags of a file as exiftool would report them, or None when the file is not a format read here or is malformed
+def readExifTags(file_path: str) -> dict:
+    if os.path.splitext(file_path)[1].lower() not in NATIVE_EXIF_EXTENSIONS:
+        return None
+    try:
+        with open(file_path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data[:2] == b"\xff\xd8":
+                    tags = readJpegTags(data)
+                elif data[:4] in [b"II*\x00", b"MM\x00*"]:
+                    tags = readTiffTags(data, 0)
+                else:
+                    return None
+    except (OSError, ValueError, struct.error, IndexError):
+        return None
+    if tags is not None:
+        tags["SourceFile"] = file_path
+    return tags
+
+
+# Walk the JPEG markers up to the start of scan, taking EXIF from APP1 and the dimensions from the frame header
+def readJpegTags(data) -> dict:
+    tags = {}
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte
+            offset += 1
+            continue
+        if marker in [0x01] or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        if marker in [0xD9, 0xDA]:
+            break
+        (length,) = struct.unpack(">H", data[offset + 2:offset + 4])
+        segment = offset + 4
+        if marker == 0xE1 and data[segment:segment + 6] == b"Exif\x00\x00" and "Make" not in tags:
+            tags.update(readTiffTags(data, segment + 6, segment + length - 2) or {})
+        elif marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[segment + 1:segment + 5])
+            tags["ImageWidth"] = width
+            tags["ImageHeight"] = height
+            break
+        offset = segment + length - 2
+    return tags
+
+
+# IFD0 and the Exif IFD of the TIFF structure starting at start, offsets inside it are relative to start
+def readTiffTags(data, start: int, end: int = None) -> dict:
+    end = len(data) if end is None else end
+    byte_order = {b"II": "<", b"MM": ">"}.get(bytes(data[start:start + 2]))
+    if byte_order is None:
+        return None
+    (ifd_offset,) = struct.unpack(byte_order + "I", data[start + 4:start + 8])
+    tags = {}
+    ifd0 = readIfd(data, start, end, ifd_offset, byte_order)
+    for tag, name in IFD0_TAGS.items():
+        if tag in ifd0:
+            tags[name] = ifd0[tag]
+    if EXIF_IFD_POINTER in ifd0:
+        exif_ifd = readIfd(data, start, end, ifd0[EXIF_IFD_POINTER], byte_order)
+        for tag, name in EXIF_IFD_TAGS.items():
+            if tag in exif_ifd:
+                tags[name] = exif_ifd[tag]
+    return tags
+
+
+# Values of the wanted tags of one IFD, single values are unwrapped and rationals turned into floats
+def readIfd(data, start: int, end: int, ifd_offset: int, byte_order: str) -> dict:
+    wanted = set(IFD0_TAGS) | set(EXIF_IFD_TAGS) | {EXIF_IFD_POINTER}
+    position = start + ifd_offset
+    if position + 2 > end:
+        return {}
+    (entry_count,) = struct.unpack(byte_order + "H", data[position:position + 2])
+    values = {}
+    for index in range(entry_count):
+        entry = position + 2 + index * 12
+        if entry + 12 > end:
+            break
+        tag, field_type, count = struct.unpack(byte_order + "HHI", data[entry:entry + 8])
+        if tag not in wanted or field_type not in FIELD_TYPES:
+            continue
+        value_format, value_size = FIELD_TYPES[field_type]
+        size = value_size * count
+        if size <= 4:
+            value_offset = entry + 8
+        else:
+            (value_offset,) = struct.unpack(byte_order + "I", data[entry + 8:entry + 12])
+            value_offset += start
+        if value_offset + size > end:
+            continue
+        raw = data[value_offset:value_offset + size]
+        if field_type == 2:
+            values[tag] = raw.split(b"\x00", 1)[0].decode("utf-8", "replace").strip()
+            continue
+        unpacked = struct.unpack(byte_order + value_format * count, raw)
+        if field_type in [5, 10]:
+            # A zero denominator is no value, so the file falls back to exiftool
+            unpacked = [numerator / denominator if denominator else None for numerator, denominator in zip(unpacked[::2], unpacked[1::2])]
+        if count == 1:
+            values[tag] = unpacked[0]
+        elif count > 1:
+            values[tag] = list(unpacked)
+    return values
@@ -0,0 +1,125 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Paths per "IN (...)" lookup, below the bound parameter limit of older SQLite builds
+SQLITE_MAX_VARIABLES = 500
+
+# Persistent cache of the trimmed metadata produced by MetadataGenerator.readRawMetadata
+# Entries are keyed by absolute path and only returned while the file size and mtime still match
+class MetadataCache:
+    def __init__(self, cache_path: str, max_entries: int = 50000) -> None:
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS metadata (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS metadata_last_used ON metadata (last_used)")
+        self.connection.commit()
+
+    @staticmethod
+    def fileKey(file: str) -> tuple:
+        stat = os.stat(file)
+        return os.path.abspath(file), stat.st_size, stat.st_mtime_ns
+
+    # Return the cached metadata for the file, or None when missing or stale
+    def get(self, file: str):
+        return self.getMany([file]).get(file)
+
+    def put(self, file: str, data: dict) -> None:
+        self.putMany({file: data})
+
+    # Cached metadata of every file that has a current entry, looked up and marked as used in one transaction
+    # Entries of files changed since they were cached are dropped
+    def getMany(self, files: list) -> dict:
+        keys = {}
+        for file in files:
+            try:
+                keys[file] = self.fileKey(file)
+            except OSError:
+                continue
+        if not keys:
+            return {}
+        rows = {}
+        paths = list({path for path, _, _ in keys.values()})
+        with self.lock:
+            for i in range(0, len(paths), SQLITE_MAX_VARIABLES):
+                chunk = paths[i:i + SQLITE_MAX_VARIABLES]
+                rows.update(
+                    (row[0], row[1:])
+                    for row in self.connection.execute(
+                        f"SELECT path, size, mtime, data FROM metadata WHERE path IN ({','.join('?' * len(chunk))})",
+                        chunk,
+                    )
+                )
+            metadata = {}
+            used = set()
+            stale = set()
+            for file, (path, size, mtime) in keys.items():
+                row = rows.get(path)
+                if row is None:
+                    continue
+                if row[0] != size or row[1] != mtime:
+                    # File changed since it was cached
+                    stale.add(path)
+                    continue
+                metadata[file] = json.loads(row[2])
+                used.add(path)
+            if used or stale:
+                now = time.time()
+                self.connection.executemany("DELETE FROM metadata WHERE path = ?", [(path,) for path in stale])
+                self.connection.executemany("UPDATE metadata SET last_used = ? WHERE path = ?", [(now, path) for path in used])
+                self.connection.commit()
+        return metadata
+
+    # Store the metadata of many files in one transaction, evicting once for the whole batch
+    def putMany(self, entries: dict) -> None:
+        now = time.time()
+        rows = []
+        for file, data in entries.items():
+            try:
+                path, size, mtime = self.fileKey(file)
+            except OSError:
+                continue
+            rows.append((path, size, mtime, json.dumps(data), now))
+        if not rows:
+            return
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO metadata (path, size, mtime, data, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.evict()
+            self.connection.commit()
+
+    # Drop the least recently used entries once the cache grows past max_entries
+    # Caller must hold lock
+    def evict(self) -> None:
+        count = self.connection.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        self.connection.execute(
+            "DELETE FROM metadata WHERE path IN (SELECT path FROM metadata ORDER BY last_used LIMIT ?)",
+            (count - self.max_entries,),
+        )
+
+    def clear(self) -> None:
+        with self.lock:
+            self.connection.execute("DELETE FROM metadata")
+            self.connection.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
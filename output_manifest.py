@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# A manifest is written whenever this many covers were recorded or this many seconds passed since it was last written,
+# so a run that is killed keeps nearly all of its progress
+SAVE_EVERY_RECORDS = 100
+SAVE_EVERY_SECONDS = 10
+
+# Record of the covers already generated into an output directory
+# Each source file maps to a digest of its size, mtime, effective metadata and render settings,
+# and to the cover written for it, so unchanged files can be skipped on the next run
+class OutputManifest:
+    def __init__(self, manifest_path: str) -> None:
+        self.manifest_path = manifest_path
+        self.lock = threading.Lock()
+        self.entries = self.readManifest()
+        self.changed = False
+        self.unsaved = 0
+        self.saved_at = time.monotonic()
+
+    def readManifest(self) -> dict:
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f).get("covers", {})
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def digest(file: str, metadata: dict, render_settings: dict) -> str:
+        stat = os.stat(file)
+        content = json.dumps(
+            {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "metadata": metadata,
+                "render": render_settings,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    # Output path of the cover generated from the same digest, or None when it has to be rendered again
+    def currentOutput(self, file: str, digest: str):
+        with self.lock:
+            entry = self.entries.get(os.path.abspath(file))
+        if entry is None or entry.get("digest") != digest or not os.path.isfile(entry.get("output", "")):
+            return None
+        return entry["output"]
+
+    def record(self, file: str, digest: str, output: str) -> None:
+        with self.lock:
+            self.entries[os.path.abspath(file)] = {"digest": digest, "output": output}
+            self.changed = True
+            self.unsaved += 1
+
+    # Write the manifest during a run once enough covers were recorded since the last write
+    def saveIfDue(self) -> None:
+        with self.lock:
+            due = self.unsaved >= SAVE_EVERY_RECORDS or time.monotonic() - self.saved_at >= SAVE_EVERY_SECONDS
+        if due:
+            self.save()
+
+    # Write the manifest through a temporary file so an interrupted run never leaves it half written
+    def save(self) -> None:
+        with self.lock:
+            if not self.changed:
+                return
+            temp_path = self.manifest_path + ".tmp"
+            with open(temp_path, "w") as f:
+                json.dump({"covers": self.entries}, f)
+            os.replace(temp_path, self.manifest_path)
+            self.changed = False
+            self.unsaved = 0
+            self.saved_at = time.monotonic()
@@ -0,0 +1,146 @@
+import queue
+import threading
+
+# Marks the end of a stage queue
+_DONE = object()
+
+
+# Raised at a checkpoint once the job has been cancelled
+class JobCancelled(Exception):
+    pass
+
+
+# Shared between a running job and whoever controls it, checked by the job between files and stages
+class CancellationToken:
+    def __init__(self) -> None:
+        self.cancelled = threading.Event()
+        self.running = threading.Event()
+        self.running.set()
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+        # Wake up a paused job so it can stop
+        self.running.set()
+
+    def pause(self) -> None:
+        self.running.clear()
+
+    def resume(self) -> None:
+        self.running.set()
+
+    def isCancelled(self) -> bool:
+        return self.cancelled.is_set()
+
+    def isPaused(self) -> bool:
+        return not self.running.is_set()
+
+    # Block while paused, raise JobCancelled once cancelled
+    def checkpoint(self) -> None:
+        self.running.wait()
+        if self.cancelled.is_set():
+            raise JobCancelled()
+
+
+# Runs items through a chain of stages, each stage served by its own threads and bounded queue,
+# so that I/O in one stage overlaps with CPU work in the next
+# stages: list of (name, function, workers), each function takes an item and returns it updated
+# At most max_in_flight items are between the feeder and the consumer at any time,
+# results are yielded as (item, error) in input order, an item that fails skips the remaining stages
+# With a CancellationToken, feeding and every stage wait while paused, and once cancelled
+# no new item is fed and items still queued come out with a JobCancelled error
+class StagedPipeline:
+    def __init__(self, stages: list, max_in_flight: int = 4) -> None:
+        self.stages = stages
+        self.max_in_flight = max(1, max_in_flight)
+
+    def run(self, items, token: CancellationToken = None):
+        stopped = threading.Event()
+        slots = threading.Semaphore(self.max_in_flight)
+        stage_queues = [queue.Queue(maxsize=self.max_in_flight) for _ in self.stages]
+        stage_queues.append(queue.Queue())
+        remaining_workers = [max(1, workers) for _, _, workers in self.stages]
+        remaining_lock = threading.Lock()
+
+        def feed():
+            try:
+                for index, item in enumerate(items):
+                    slots.acquire()
+                    if token is not None:
+                        token.running.wait()
+                    if stopped.is_set() or (token is not None and token.isCancelled()):
+                        break
+                    stage_queues[0].put((index, item, None))
+            finally:
+                for _ in range(remaining_workers[0]):
+                    stage_queues[0].put(_DONE)
+
+        def work(stage_index):
+            name, function, _ = self.stages[stage_index]
+            while True:
+                entry = stage_queues[stage_index].get()
+                if entry is _DONE:
+                    break
+                index, item, error = entry
+                if error is None and not stopped.is_set():
+                    try:
+                        if token is not None:
+                            token.checkpoint()
+                        item = function(item)
+                    except Exception as e:
+                        error = e
+                stage_queues[stage_index + 1].put((index, item, error))
+            with remaining_lock:
+                remaining_workers[stage_index] -= 1
+                last_worker = remaining_workers[stage_index] == 0
+            # Last worker of a stage closes the next stage
+            if last_worker:
+                next_workers = remaining_workers[stage_index + 1] if stage_index + 1 < len(self.stages) else 1
+                for _ in range(next_workers):
+                    stage_queues[stage_index + 1].put(_DONE)
+
+        threads = [threading.Thread(target=feed, daemon=True)]
+        for stage_index, (name, _, workers) in enumerate(self.stages):
+            for worker_index in range(remaining_workers[stage_index]):
+                threads.append(
+                    threading.Thread(target=work, args=(stage_index,), name=f"{name}-{worker_index}", daemon=True)
+                )
+        for thread in threads:
+            thread.start()
+
+        # Reorder finished items so results come out in input order
+        finished = {}
+        next_index = 0
+        try:
+            while True:
+                entry = stage_queues[-1].get()
+                if entry is _DONE:
+                    break
+                index, item, error = entry
+                finished[index] = (item, error)
+                while next_index in finished:
+                    yield finished.pop(next_index)
+                    next_index += 1
+                    slots.release()
+        finally:
+            # Consumer stopped early, let the feeder exit and the stages drain what is queued
+            stopped.set()
+            slots.release()
+
+    # Run every stage of one item after another in the calling thread, with the same results as run
+    # Used when the work has to stay on one thread, e.g. while it is being profiled with cProfile
+    def runInline(self, items, token: CancellationToken = None):
+        for item in items:
+            if token is not None:
+                token.running.wait()
+                if token.isCancelled():
+                    break
+            error = None
+            for _, function, _ in self.stages:
+                try:
+                    if token is not None:
+                        token.checkpoint()
+                    item = function(item)
+                except Exception as e:
+                    error = e
+                    break
+            yield item, error
@@ -0,0 +1,178 @@
+import ctypes
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-stage timing of a generation job
+# Every timed stage becomes a record of stage name, file, wall clock start, duration and thread,
+# which can be summarised (p50/p95 per stage, bytes read and written, peak RSS) or exported as a Chrome trace
+
+
+def peakRss(children: bool = False) -> int:
+    # Peak resident set size of this process in bytes, None when the platform cannot tell
+    # children gives the largest of the finished child processes instead, e.g. the worker pool of a parallel job
+    try:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        pass
+    if children or sys.platform != "win32":
+        return None
+    return peakWorkingSet()
+
+
+class ProcessMemoryCounters(ctypes.Structure):
+    # PROCESS_MEMORY_COUNTERS of psapi.h
+    _fields_ = [
+        ("cb", ctypes.c_uint32),
+        ("PageFaultCount", ctypes.c_uint32),
+        ("PeakWorkingSetSize", ctypes.c_size_t),
+        ("WorkingSetSize", ctypes.c_size_t),
+        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+        ("PagefileUsage", ctypes.c_size_t),
+        ("PeakPagefileUsage", ctypes.c_size_t),
+    ]
+
+
+def peakWorkingSet() -> int:
+    # Windows equivalent of the peak RSS, read through the Win32 API so no extra package is needed
+    kernel32 = ctypes.WinDLL("kernel32")
+    kernel32.GetCurrentProcess.restype = ctypes.c_void_p
+    kernel32.K32GetProcessMemoryInfo.argtypes = [ctypes.c_void_p, ctypes.POINTER(ProcessMemoryCounters), ctypes.c_uint32]
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(ProcessMemoryCounters)
+    if not kernel32.K32GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+        return None
+    return counters.PeakWorkingSetSize
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class JobProfiler:
+    def __init__(self, cprofile: bool = False) -> None:
+        self.records = []
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.end_time = None
+        self.profile = None
+        if cprofile:
+            import cProfile
+
+            self.profile = cProfile.Profile()
+
+    @contextmanager
+    def stage(self, name: str, file: str = None, bytes_read: int = 0):
+        start = time.time()
+        start_counter = time.perf_counter()
+        record = {
+            "stage": name,
+            "file": file,
+            "start": start,
+            "duration": 0.0,
+            "bytes_read": bytes_read,
+            "bytes_written": 0,
+            "pid": os.getpid(),
+            "thread": threading.current_thread().name,
+        }
+        try:
+            yield record
+        finally:
+            record["duration"] = time.perf_counter() - start_counter
+            with self.lock:
+                self.records.append(record)
+
+    # Records from a profiler in a worker process
+    def merge(self, records: list) -> None:
+        with self.lock:
+            self.records.extend(records)
+
+    def startCProfile(self) -> None:
+        if self.profile is not None:
+            self.profile.enable()
+
+    def stopCProfile(self, output_path: str = None) -> None:
+        if self.profile is None:
+            return
+        self.profile.disable()
+        if output_path:
+            self.profile.dump_stats(output_path)
+
+    def finish(self) -> None:
+        self.end_time = time.time()
+
+    def summary(self) -> dict:
+        with self.lock:
+            records = list(self.records)
+        stages = {}
+        files = {}
+        for record in records:
+            stages.setdefault(record["stage"], []).append(record)
+            if record["file"] is not None:
+                file_stats = files.setdefault(record["file"], {"seconds": 0.0, "bytes_read": 0, "bytes_written": 0})
+                file_stats["seconds"] += record["duration"]
+                file_stats["bytes_read"] += record["bytes_read"]
+                file_stats["bytes_written"] += record["bytes_written"]
+        end_time = self.end_time or time.time()
+        return {
+            "wall_seconds": end_time - self.start_time,
+            "files": len(files),
+            "bytes_read": sum(record["bytes_read"] for record in records),
+            "bytes_written": sum(record["bytes_written"] for record in records),
+            "peak_rss": peakRss(),
+            "peak_rss_workers": peakRss(children=True),
+            "stages": {
+                name: {
+                    "count": len(stage_records),
+                    "total": sum(record["duration"] for record in stage_records),
+                    "mean": sum(record["duration"] for record in stage_records) / len(stage_records),
+                    "p50": percentile([record["duration"] for record in stage_records], 0.5),
+                    "p95": percentile([record["duration"] for record in stage_records], 0.95),
+                    "max": max(record["duration"] for record in stage_records),
+                }
+                for name, stage_records in stages.items()
+            },
+            "per_file": files,
+        }
+
+    def exportJson(self, output_path: str) -> None:
+        with open(output_path, "w") as f:
+            json.dump({"summary": self.summary(), "records": self.records}, f, indent=2)
+
+    # Trace Event Format, open with chrome://tracing or https://ui.perfetto.dev
+    def exportChromeTrace(self, output_path: str) -> None:
+        with self.lock:
+            records = list(self.records)
+        events = [
+            {
+                "name": record["stage"],
+                "cat": "generator",
+                "ph": "X",
+                "ts": (record["start"] - self.start_time) * 1_000_000,
+                "dur": record["duration"] * 1_000_000,
+                "pid": record["pid"],
+                "tid": record["thread"],
+                "args": {
+                    "file": record["file"],
+                    "bytes_read": record["bytes_read"],
+                    "bytes_written": record["bytes_written"],
+                },
+            }
+            for record in records
+        ]
+        with open(output_path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
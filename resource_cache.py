@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from functools import lru_cache
+import threading
+from PIL import Image, ImageFont, ImageOps
+
+# Fonts and brand logos shared by every cover rendered in this process
+# Cached objects are treated as read only by the callers
+
+
+@lru_cache(maxsize=32)
+def loadFont(font_path: str, size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(font_path, size=size)
+
+
+@lru_cache(maxsize=64)
+def loadLogo(brand_logo_path: str, brand: str) -> Image.Image:
+    logo_image = Image.open(f"{brand_logo_path}/{brand}.png").convert("RGBA")
+    logo_image.load()
+    return logo_image
+
+
+# Brand logo scaled to fit inside box, keyed by brand and target box
+@lru_cache(maxsize=64)
+def loadScaledLogo(brand_logo_path: str, brand: str, box: tuple) -> Image.Image:
+    return ImageOps.contain(loadLogo(brand_logo_path, brand), box)
+
+
+# Width and height of text drawn with a font, as draw.textbbox would measure it
+@lru_cache(maxsize=1024)
+def measureText(font_path: str, size: int, text: str) -> tuple:
+    left, top, right, bottom = loadFont(font_path, size).getbbox(text)
+    return right - left, bottom - top
+
+
+# Rendered cover footers, shared by every cover with the same footer key
+# Bounded by the memory of the footer images, least recently used ones are dropped first
+FOOTER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+_footers = OrderedDict()
+_footers_bytes = 0
+_footers_lock = threading.Lock()
+
+
+# Footer for key, rendered with render() when it is not cached yet
+def loadFooter(key: tuple, render) -> Image.Image:
+    global _footers_bytes
+    with _footers_lock:
+        footer = _footers.get(key)
+        if footer is not None:
+            _footers.move_to_end(key)
+            return footer
+    footer = render()
+    footer_bytes = footer.width * footer.height * len(footer.getbands())
+    with _footers_lock:
+        if key not in _footers and footer_bytes <= FOOTER_CACHE_MAX_BYTES:
+            _footers[key] = footer
+            _footers_bytes += footer_bytes
+            while _footers_bytes > FOOTER_CACHE_MAX_BYTES:
+                _, evicted = _footers.popitem(last=False)
+                _footers_bytes -= evicted.width * evicted.height * len(evicted.getbands())
+    return footer
+
@@ -0,0 +1,204 @@
+import argparse
+import json
+import mimetypes
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from etif import AppSettings, MetadataGenerator, DECODE_QUALITIES, IMAGE_EXTENSIONS, debug
+from output_manifest import OutputManifest
+from cli import stopOnTerminate
+
+# Local HTTP/JSON service rendering single covers for other tools, e.g. a DAM plugin
+#   python server.py --port 8765
+# POST /render with a JSON body:
+#   {"path": "J:/2024_03/IMG_0001.CR2"}
+#   {"path": "J:/2024_03/IMG_0001.CR2", "settings": {"MODEL": "EOS R6", "ISO": "800"}, "combine": true, "response": "image"}
+# "settings" takes the camera settings keys of the Manual tab and overrides what is read from the file,
+# a body of {path: settings} as built by the Manual tab is accepted too
+# "response": "path" (default) answers {"file", "output", "error"}, "image" answers the encoded cover itself
+# GET /health reports the renders running and waiting
+# Exiftool, fonts, logos and the worker processes are started once, so a request only pays for its own cover
+# At most Concurrency covers render at once, up to Max_Queue requests wait for a slot and the rest get 503
+
+
+# Bounds the renders running at once and the requests waiting for one
+class RenderLimiter:
+    def __init__(self, concurrency: int, max_queue: int) -> None:
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+
+    # Take a render slot, False when the queue is full or no slot freed up within timeout seconds
+    def acquire(self, timeout: float) -> bool:
+        with self.lock:
+            if self.active >= self.concurrency and self.waiting >= self.max_queue:
+                return False
+            self.waiting += 1
+        acquired = self.slots.acquire(timeout=timeout)
+        with self.lock:
+            self.waiting -= 1
+            if acquired:
+                self.active += 1
+        return acquired
+
+    def release(self) -> None:
+        with self.lock:
+            self.active -= 1
+        self.slots.release()
+
+    def status(self) -> dict:
+        with self.lock:
+            return {"active": self.active, "waiting": self.waiting, "concurrency": self.concurrency, "max_queue": self.max_queue}
+
+
+class RenderService:
+    def __init__(self, generator: MetadataGenerator, server_settings: dict, combine_original_images: bool = False) -> None:
+        self.generator = generator
+        self.combine_original_images = combine_original_images
+        self.queue_timeout = server_settings["Queue_Timeout"]
+        self.limiter = RenderLimiter(server_settings["Concurrency"], server_settings["Max_Queue"])
+
+    # Camera settings and target file of a request body, raises ValueError when it is not a render request
+    def parseRequest(self, body: dict) -> tuple:
+        if not isinstance(body, dict):
+            raise ValueError("request body must be a JSON object")
+        file = body.get("path")
+        overrides = body.get("settings") or {}
+        if file is None and len(body) == 1:
+            # {path: settings} as built by updateManualSettings
+            file, overrides = next(iter(body.items()))
+        if not isinstance(file, str) or not isinstance(overrides, dict):
+            raise ValueError("request needs a \"path\" string and an optional \"settings\" object")
+        file = file.replace("\\", "/")
+        if os.path.splitext(file)[1].lower() not in IMAGE_EXTENSIONS:
+            raise ValueError(f"unsupported file type: {file}")
+        if not os.path.isfile(file):
+            raise ValueError(f"file not found: {file}")
+        return file, overrides
+
+    # Render the cover of one file, in a worker process when the generator keeps a pool
+    # Covers are always rendered, the output manifest records them so a batch job renders its own cover over one that
+    # was made with other camera settings
+    def render(self, file: str, overrides: dict, combine_original_images: bool) -> dict:
+        data = self.generator.readFileMetadata(file)
+        if data is None:
+            if not overrides:
+                return {"file": file, "output": None, "error": "no camera settings found"}
+            data = {}
+        data = {**data, **overrides}
+        if self.generator.process_pool is not None:
+            result = self.generator.submitCover(file, data, combine_original_images).result()
+        else:
+            result = self.generator.renderFile(file, data, combine_original_images)
+        if result["error"] is None and self.generator.getOutputManifest() is not None:
+            digest = OutputManifest.digest(file, data, self.generator.renderSettings(combine_original_images))
+            self.generator.recordOutput(file, digest, result["output"])
+        return result
+
+
+def createRequestHandler(service: RenderService):
+    class RenderRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.rstrip("/") != "/health":
+                self.sendJson(404, {"error": "not found"})
+                return
+            self.sendJson(200, {"status": "ok", "workers": service.generator.workers, **service.limiter.status()})
+
+        def do_POST(self) -> None:
+            if self.path.rstrip("/") != "/render":
+                self.sendJson(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                file, overrides = service.parseRequest(body)
+            except ValueError as e:
+                self.sendJson(400, {"error": str(e)})
+                return
+            combine_original_images = bool(body.get("combine", service.combine_original_images)) if "path" in body else service.combine_original_images
+            if not service.limiter.acquire(service.queue_timeout):
+                self.sendJson(503, {"error": "busy, try again later", **service.limiter.status()}, {"Retry-After": "1"})
+                return
+            try:
+                result = service.render(file, overrides, combine_original_images)
+            except Exception as e:
+                # e.g. exiftool missing or failing on the file
+                debug("ERROR", RenderRequestHandler.do_POST.__name__, (file, e))
+                result = {"file": file, "output": None, "error": f"{type(e).__name__}: {e}"}
+            finally:
+                service.limiter.release()
+            if result["error"] is not None:
+                self.sendJson(500, result)
+            elif body.get("response") == "image":
+                self.sendFile(result["output"])
+            else:
+                self.sendJson(200, result)
+
+        def sendJson(self, status: int, content: dict, headers: dict = {}) -> None:
+            data = json.dumps(content).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def sendFile(self, output_path: str) -> None:
+            with open(output_path, "rb") as f:
+                data = f.read()
+            self.send_response(200)
+            self.send_header("Content-Type", mimetypes.guess_type(output_path)[0] or "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("X-Cover-Path", output_path)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format: str, *args) -> None:
+            debug("DEBUG", RenderRequestHandler.log_message.__name__, (self.address_string(), format % args))
+
+    return RenderRequestHandler
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Serve cover rendering over local HTTP")
+    parser.add_argument("--settings", default=os.getcwd() + "/settings.json", help="path to settings.json")
+    parser.add_argument("--host", help="address to listen on, defaults to Server Host in settings")
+    parser.add_argument("--port", type=int, help="port to listen on, defaults to Server Port in settings")
+    parser.add_argument("--combine", action="store_true", default=None, help="combine original images unless a request says otherwise")
+    parser.add_argument("--decode-quality", choices=DECODE_QUALITIES, help="RAW decode tier")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parseArguments(argv)
+    settings = AppSettings(args.settings)
+    server_settings = settings.getServerSettings()
+    combine_original_images = args.combine if args.combine is not None else server_settings["Combine_Original_Images"]
+
+    # Installed before the pool starts, so the workers inherit it
+    stopOnTerminate()
+    generator = MetadataGenerator(settings.getSettings().get("settings").get("Brand_Logo_Path"), settings)
+    generator.show_images = False
+    generator.decode_quality = args.decode_quality or settings.getDecodeQuality()
+    generator.warmUp()
+    os.makedirs(settings.getOutputPath(), exist_ok=True)
+    service = RenderService(generator, server_settings, combine_original_images)
+    httpd = ThreadingHTTPServer((args.host or server_settings["Host"], args.port or server_settings["Port"]), createRequestHandler(service))
+    debug("DEBUG", main.__name__, ("LISTENING", httpd.server_address, "WORKERS", generator.workers))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        generator.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import struct
+import zlib
+from PIL import Image
+
+# Strip by strip compositing for covers too large to hold as one canvas, and for placeholder covers
+# The cover is never assembled: each strip of rows is built from the image and the footer and handed straight to the
+# PNG encoder, so besides the image itself only one strip of the cover is in memory at a time
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Compressed data is written in IDAT chunks of about this size
+IDAT_CHUNK_SIZE = 1 << 20
+
+
+# Image area of a single colour, e.g. the placeholder when original images are not combined
+# Stands in for an image without allocating its pixels
+class SolidImage:
+    def __init__(self, size: tuple, color: tuple = (0, 0, 0)) -> None:
+        self.size = size
+        self.color = color
+        self.mode = "RGB"
+
+
+class TiledCover:
+    def __init__(self, width: int, height: int, image: Image.Image, image_position: tuple, footer: Image.Image) -> None:
+        self.width = width
+        self.height = height
+        self.image = image
+        self.image_position = image_position
+        self.footer = footer
+
+    # Exact palette version of a cover whose image area is a SolidImage
+    # Returns the palette as RGB bytes, the footer as a "P" image, and the palette indexes of white and the solid colour,
+    # or None when the footer has too many colours for a palette
+    def paletteCover(self) -> tuple:
+        if not isinstance(self.image, SolidImage):
+            return None
+        # One extra row carries white and the solid colour so they get palette entries too
+        source = Image.new("RGB", (max(2, self.width), self.footer.height + 1), color="white")
+        source.paste(self.footer, (0, 0))
+        source.putpixel((1, self.footer.height), self.image.color)
+        if source.getcolors(256) is None:
+            return None
+        # Median cut keeps every colour as is when there are no more than 256 of them
+        quantized = source.quantize(colors=256, method=Image.Quantize.MEDIANCUT)
+        if quantized.convert("RGB").tobytes() != source.tobytes():
+            return None
+        palette = quantized.getpalette()[:(max(index for _, index in quantized.getcolors()) + 1) * 3]
+        footer = quantized.crop((0, 0, self.width, self.footer.height))
+        return (
+            bytes(palette),
+            footer,
+            quantized.getpixel((0, self.footer.height)),
+            quantized.getpixel((1, self.footer.height)),
+        )
+
+    # Rows top to bottom as RGB bytes, or as palette indexes when given the result of paletteCover,
+    # strip_height rows at a time
+    def iterStrips(self, strip_height: int = 256, palette_cover: tuple = None):
+        image_x, image_y = self.image_position
+        image_width, image_height = self.image.size
+        footer = self.footer
+        mode, background = "RGB", "white"
+        if palette_cover is not None:
+            _, footer, background, solid_index = palette_cover
+            mode = "P"
+        footer_y = self.height - footer.height
+        for top in range(0, self.height, strip_height):
+            bottom = min(self.height, top + strip_height)
+            strip = Image.new(mode, (self.width, bottom - top), color=background)
+            if top < image_y + image_height and bottom > image_y:
+                image_top = max(top, image_y)
+                image_bottom = min(bottom, image_y + image_height)
+                if isinstance(self.image, SolidImage):
+                    color = solid_index if palette_cover is not None else self.image.color
+                    strip.paste(color, (image_x, image_top - top, image_x + image_width, image_bottom - top))
+                else:
+                    rows = self.image.crop((0, image_top - image_y, image_width, image_bottom - image_y))
+                    strip.paste(rows.convert("RGB") if rows.mode != "RGB" else rows, (image_x, image_top - top))
+            if bottom > footer_y:
+                footer_top = max(top, footer_y)
+                strip.paste(footer.crop((0, footer_top - footer_y, self.width, bottom - footer_y)), (0, footer_top - top))
+            yield strip.tobytes()
+
+    # Assemble the whole cover, for encoders that need it in one piece
+    def toImage(self) -> Image.Image:
+        new_image = Image.new("RGB", (self.width, self.height), color="white")
+        if isinstance(self.image, SolidImage):
+            image_x, image_y = self.image_position
+            new_image.paste(self.image.color, (image_x, image_y, image_x + self.image.size[0], image_y + self.image.size[1]))
+        else:
+            new_image.paste(self.image.convert("RGB") if self.image.mode != "RGB" else self.image, self.image_position)
+        new_image.paste(self.footer, (0, self.height - self.footer.height))
+        return new_image
+
+    # Encode as an 8-bit PNG while the strips are produced, palette based when the colours allow it
+    # Rows are stored unfiltered, which keeps encoding streamable at the cost of somewhat larger files
+    def savePng(self, output_path: str, compress_level: int = 6, strip_height: int = 256) -> None:
+        palette_cover = self.paletteCover()
+        row_size = self.width * (1 if palette_cover is not None else 3)
+        # Run length matching is about twice as fast on the long single colour runs of placeholder covers
+        strategy = zlib.Z_RLE if isinstance(self.image, SolidImage) else zlib.Z_DEFAULT_STRATEGY
+        compressor = zlib.compressobj(compress_level, zlib.DEFLATED, 15, 8, strategy)
+        with open(output_path, "wb") as f:
+            f.write(PNG_SIGNATURE)
+            if palette_cover is not None:
+                writePngChunk(f, b"IHDR", struct.pack(">IIBBBBB", self.width, self.height, 8, 3, 0, 0, 0))
+                writePngChunk(f, b"PLTE", palette_cover[0])
+            else:
+                writePngChunk(f, b"IHDR", struct.pack(">IIBBBBB", self.width, self.height, 8, 2, 0, 0, 0))
+            pending = []
+            pending_size = 0
+            for strip in self.iterStrips(strip_height, palette_cover):
+                rows = b"".join(
+                    b"\x00" + strip[offset:offset + row_size] for offset in range(0, len(strip), row_size)
+                )
+                data = compressor.compress(rows)
+                if data:
+                    pending.append(data)
+                    pending_size += len(data)
+                if pending_size >= IDAT_CHUNK_SIZE:
+                    writePngChunk(f, b"IDAT", b"".join(pending))
+                    pending = []
+                    pending_size = 0
+            pending.append(compressor.flush())
+            writePngChunk(f, b"IDAT", b"".join(pending))
+            writePngChunk(f, b"IEND", b"")
+
+
+def writePngChunk(f, chunk_type: bytes, data: bytes) -> None:
+    f.write(struct.pack(">I", len(data)))
+    f.write(chunk_type)
+    f.write(data)
+    f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type)) & 0xFFFFFFFF))
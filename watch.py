@@ -0,0 +1,243 @@
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from etif import AppSettings, MetadataGenerator, DECODE_QUALITIES, IMAGE_EXTENSIONS, debug
+from cli import generateFiles, stopOnTerminate
+
+# Watch folders and generate covers for images as they land, e.g. after a card ingest
+#   python watch.py J:/Ingest --combine
+#   python watch.py            (directories from "Watch" in settings.json)
+# A file is picked up once its size and modification time have not changed for Settle_Seconds,
+# so files still being copied are left alone
+# One generator is kept warm for the whole run, so exiftool, fonts, logos and worker processes are started once
+
+# inotify event masks, see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def isImageFile(path: str) -> bool:
+    name = os.path.basename(path)
+    return not name.startswith(".") and os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def isExcluded(directory: str, excluded_path: str) -> bool:
+    if not excluded_path:
+        return False
+    directory = os.path.abspath(directory)
+    return directory == excluded_path or directory.startswith(excluded_path + os.sep)
+
+
+# Image files below the directories, covers inside the output path are left out
+def scanDirectories(directories: list, recursive: bool, excluded_path: str = None) -> list:
+    files = []
+    for directory in directories:
+        for root, dirs, names in os.walk(directory):
+            if isExcluded(root, excluded_path):
+                dirs[:] = []
+                continue
+            files += [os.path.join(root, name).replace("\\", "/") for name in sorted(names) if isImageFile(name)]
+            if not recursive:
+                break
+    return files
+
+
+# Directory watcher built on Linux inotify through libc, no extra dependency needed
+class InotifyWatcher:
+    def __init__(self, directories: list, recursive: bool = True, excluded_path: str = None) -> None:
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.recursive = recursive
+        self.excluded_path = excluded_path
+        self.directories = directories
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+        for directory in directories:
+            self.addWatch(directory)
+
+    def addWatch(self, directory: str) -> None:
+        if isExcluded(directory, self.excluded_path):
+            return
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+        if wd < 0:
+            debug("ERROR", InotifyWatcher.addWatch.__name__, (directory, os.strerror(ctypes.get_errno())))
+            return
+        self.watches[wd] = directory
+        if self.recursive:
+            for entry in os.scandir(directory):
+                if entry.is_dir(follow_symlinks=False):
+                    self.addWatch(entry.path)
+
+    # Paths created or written since the last call, waiting up to timeout seconds for the first one
+    def poll(self, timeout: float) -> list:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            wd, mask, _, name_length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + name_length].rstrip(b"\x00")
+            offset += INOTIFY_EVENT.size + name_length
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped, look at everything again
+                paths += scanDirectories(self.directories, self.recursive, self.excluded_path)
+                continue
+            if wd not in self.watches:
+                continue
+            path = os.path.join(self.watches[wd], os.fsdecode(name)).replace("\\", "/")
+            if mask & IN_ISDIR:
+                if self.recursive:
+                    # Files copied in before the watch was added only show up in a scan
+                    self.addWatch(path)
+                    paths += scanDirectories([path], True, self.excluded_path)
+            elif isImageFile(path) and not isExcluded(os.path.dirname(path), self.excluded_path):
+                paths.append(path)
+        return paths
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+# Directory watcher comparing directory listings, used where inotify is not available
+class PollingWatcher:
+    def __init__(self, directories: list, recursive: bool = True, excluded_path: str = None) -> None:
+        self.directories = directories
+        self.recursive = recursive
+        self.excluded_path = excluded_path
+        self.snapshot = self.scan()
+
+    def scan(self) -> dict:
+        snapshot = {}
+        for path in scanDirectories(self.directories, self.recursive, self.excluded_path):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def poll(self, timeout: float) -> list:
+        time.sleep(timeout)
+        snapshot = self.scan()
+        paths = [path for path, signature in snapshot.items() if self.snapshot.get(path) != signature]
+        self.snapshot = snapshot
+        return paths
+
+    def close(self) -> None:
+        pass
+
+
+def createWatcher(directories: list, recursive: bool, excluded_path: str, polling: bool = False):
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(directories, recursive, excluded_path)
+        except (OSError, AttributeError) as e:
+            debug("ERROR", createWatcher.__name__, ("INOTIFY UNAVAILABLE, POLLING", e))
+    return PollingWatcher(directories, recursive, excluded_path)
+
+
+# Files whose size and modification time stayed the same for settle_seconds
+class SettleTracker:
+    def __init__(self, settle_seconds: float) -> None:
+        self.settle_seconds = settle_seconds
+        self.pending = {}
+
+    def add(self, paths: list) -> None:
+        for path in paths:
+            self.pending[path] = None
+
+    def settled(self) -> list:
+        now = time.monotonic()
+        ready = []
+        for path, state in list(self.pending.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Removed or renamed before it settled
+                del self.pending[path]
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if state is None or state[0] != signature:
+                self.pending[path] = (signature, now)
+            elif stat.st_size > 0 and now - state[1] >= self.settle_seconds:
+                del self.pending[path]
+                ready.append(path)
+        return sorted(ready)
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Generate covers for images as they are added to watched folders")
+    parser.add_argument("directories", nargs="*", help="directories to watch, defaults to Watch Directories in settings")
+    parser.add_argument("--settings", default=os.getcwd() + "/settings.json", help="path to settings.json")
+    parser.add_argument("--combine", action="store_true", default=None, help="combine original images with the cover")
+    parser.add_argument("--decode-quality", choices=DECODE_QUALITIES, help="RAW decode tier")
+    parser.add_argument("--existing", action="store_true", help="also generate covers for images already in the folders")
+    parser.add_argument("--poll", action="store_true", help="poll the folders instead of using inotify")
+    parser.add_argument("--json", action="store_true", help="print one JSON object per line for progress")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parseArguments(argv)
+    settings = AppSettings(args.settings)
+    watch_settings = settings.getWatchSettings()
+    directories = [directory.replace("\\", "/") for directory in (args.directories or watch_settings["Directories"])]
+    directories = [directory for directory in directories if os.path.isdir(directory)]
+    if not directories:
+        print("No directories to watch", file=sys.stderr)
+        return 2
+    # Covers written into a watched folder must not be picked up again, so the output path is left out of the watch
+    excluded_path = os.path.abspath(settings.getOutputPath())
+    watched_outputs = [directory for directory in directories if isExcluded(directory, excluded_path)]
+    if watched_outputs:
+        print(f"Output path {excluded_path} contains the watched directories {watched_outputs}, "
+              "use an output path outside of them or a subfolder of them", file=sys.stderr)
+        return 2
+    combine_original_images = args.combine if args.combine is not None else watch_settings["Combine_Original_Images"]
+
+    # Installed before the pool starts, so the workers inherit it
+    stopOnTerminate()
+    generator = MetadataGenerator(settings.getSettings().get("settings").get("Brand_Logo_Path"), settings)
+    generator.show_images = False
+    generator.decode_quality = args.decode_quality or settings.getDecodeQuality()
+    generator.warmUp()
+    os.makedirs(excluded_path, exist_ok=True)
+    watcher = createWatcher(directories, watch_settings["Recursive"], excluded_path, args.poll or watch_settings["Polling"])
+    tracker = SettleTracker(watch_settings["Settle_Seconds"])
+    if args.existing or watch_settings["Process_Existing"]:
+        tracker.add(scanDirectories(directories, watch_settings["Recursive"], excluded_path))
+    debug("DEBUG", main.__name__, ("WATCHING", directories, type(watcher).__name__))
+    try:
+        while True:
+            tracker.add(watcher.poll(watch_settings["Poll_Interval"]))
+            files = tracker.settled()
+            if files:
+                generateFiles(generator, files, combine_original_images, args.json)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        generator.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())